@@ -0,0 +1,161 @@
+# admission.py
+# 몰리는 요청 제어: 같은 질문 동시 요청 합치기(single-flight), LLM 단계 대기열 제한, 클라이언트별 요청 속도 제한
+import os
+import math
+import time
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from metrics import RESILIENCE_EVENTS_TOTAL
+
+# 동시에 LLM 단계에 들어가지 못하고 기다릴 수 있는 최대 요청 수, 최대 대기 시간(초)
+ADMISSION_MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING", "32"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "20"))
+# 클라이언트별 허용 속도 (분당 요청 수, 순간 허용량)
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "20"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "5"))
+# 배치 요청은 글 수만큼 따로 셈 (분당 글 수, 순간 허용량 = 배치 한 번의 최대 글 수)
+RATE_LIMIT_BATCH_PER_MINUTE = float(os.getenv("RATE_LIMIT_BATCH_PER_MINUTE", "60"))
+RATE_LIMIT_BATCH_BURST = int(os.getenv("RATE_LIMIT_BATCH_BURST", os.getenv("COACH_BATCH_MAX_TEXTS", "20")))
+
+
+class Overloaded(Exception):
+    """지금은 처리할 수 없음 → 429 + Retry-After(초)"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SingleFlight:
+    """같은 키로 동시에 들어온 작업은 한 번만 실행하고 결과를 같이 받음"""
+
+    def __init__(self):
+        self._tasks = {}   # 비동기: key -> asyncio.Task
+        self._calls = {}   # 동기(스레드): key -> {"event", "result", "error"}
+        self._lock = threading.Lock()
+
+    async def run_async(self, key, make_coro):
+        """반환: (결과, 다른 요청의 결과를 같이 받았는지)"""
+        task = self._tasks.get(key)
+        if task is not None:
+            RESILIENCE_EVENTS_TOTAL.inc("coalesced")
+            # 먼저 온 요청이 취소(연결 끊김)돼도 작업은 계속되도록 shield
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(make_coro())
+        self._tasks[key] = task
+        task.add_done_callback(lambda t: self._finish_task(key, t))
+        return await asyncio.shield(task), False
+
+    def _finish_task(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # 기다리던 요청이 모두 끊겨도 경고가 나지 않도록 예외를 읽어 둠
+
+    def run(self, key, fn):
+        """run_async의 동기 버전 (Streamlit 등 스레드에서 호출)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"event": threading.Event(), "result": None, "error": None}
+        if not leader:
+            RESILIENCE_EVENTS_TOTAL.inc("coalesced")
+            call["event"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"], True
+
+        try:
+            call["result"] = fn()
+            return call["result"], False
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["event"].set()
+
+
+class AdmissionQueue:
+    """
+    동시 실행 수(max_active)를 넘는 요청은 max_waiting개까지만 기다리게 하고, 그 이상이면 바로 거절
+    Retry-After는 최근 처리 시간 평균과 대기열 길이로 추정
+    """
+
+    def __init__(self, max_active, max_waiting=ADMISSION_MAX_WAITING, max_wait=ADMISSION_MAX_WAIT_SECONDS):
+        self.max_active = max_active
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.semaphore = asyncio.Semaphore(max_active)
+        self.in_flight = 0      # 실행 중 + 대기 중인 요청 수
+        self.avg_seconds = 1.0  # 한 요청이 자리를 차지하는 시간 (지수 이동 평균)
+
+    def retry_after(self):
+        waiting = max(0, self.in_flight - self.max_active)
+        return max(1, math.ceil((waiting + 1) / self.max_active * self.avg_seconds))
+
+    def check(self, count=1):
+        """count개의 작업이 들어갈 자리가 없으면 Overloaded (배치처럼 여러 자리를 쓰는 요청은 먼저 확인)"""
+        # 세마포어 상태는 대기 중인 요청이 실제로 깨어나야 바뀌므로, 몰려온 요청은 직접 센 숫자로 판단
+        if self.in_flight + count > self.max_active + self.max_waiting:
+            RESILIENCE_EVENTS_TOTAL.inc("rejected")
+            raise Overloaded("요청이 많아 잠시 후 다시 시도해주세요.", self.retry_after())
+
+    @asynccontextmanager
+    async def slot(self):
+        self.check()
+        self.in_flight += 1
+        try:
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), self.max_wait)
+            except TimeoutError:
+                RESILIENCE_EVENTS_TOTAL.inc("rejected")
+                raise Overloaded("대기 시간이 초과되었습니다. 잠시 후 다시 시도해주세요.", self.retry_after())
+            started = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.semaphore.release()
+                self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * (time.perf_counter() - started)
+        finally:
+            self.in_flight -= 1
+
+
+class RateLimiter:
+    """클라이언트별 토큰 버킷 (분당 rate개 충전, 최대 burst개)"""
+
+    def __init__(self, per_minute=RATE_LIMIT_PER_MINUTE, burst=RATE_LIMIT_BURST):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.buckets = {}  # client -> (남은 토큰, 마지막 갱신 시각)
+        self._lock = threading.Lock()
+
+    def allows(self, cost):
+        """한 번에 cost개를 쓸 수 있는 요청인지 (속도 제한이 꺼져 있으면 항상 가능)"""
+        return self.rate <= 0 or cost <= self.burst
+
+    def acquire(self, client, cost=1):
+        """
+        허용되면 None, 아니면 다시 시도할 때까지 기다릴 시간(초)
+        cost가 burst보다 크면 기다려도 통과할 수 없으므로 호출 전에 allows()로 확인
+        """
+        if self.rate <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self.buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < cost:
+                self.buckets[client] = (tokens, now)
+                return max(1, math.ceil((cost - tokens) / self.rate))
+            self.buckets[client] = (tokens - cost, now)
+            # 가득 찬 버킷은 기본값과 같으므로 가끔 정리 (메모리 증가 방지)
+            if len(self.buckets) > 10000:
+                full = [c for c, (t, u) in self.buckets.items() if t + (now - u) * self.rate >= self.burst]
+                for c in full:
+                    del self.buckets[c]
+        return None
@@ -1,11 +1,72 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+import os
+import hmac
+import json
+import hashlib
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Annotated, Literal, Optional
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from pydantic import BaseModel, Field
 from fastapi.middleware.cors import CORSMiddleware
-from rag_system import CareerAI
 from career_data import CAREER_TIPS
+from metrics import start_trace, end_trace, render_prometheus
+from user_db import init_user_db, save_message, iter_history_csv, shutdown as shutdown_user_db
+from admission import Overloaded, RateLimiter, RATE_LIMIT_BATCH_PER_MINUTE, RATE_LIMIT_BATCH_BURST
+from replay import TrafficRecorder
+
+# 배치 코칭 한 번에 받을 수 있는 최대 글 수 (배치 속도 제한의 순간 허용량보다 클 수 없음),
+# 글 하나의 최대 길이 (파일 추출 제한 MAX_EXTRACT_CHARS와 같은 기본값)
+BATCH_MAX_TEXTS = min(int(os.getenv("COACH_BATCH_MAX_TEXTS", "20")), RATE_LIMIT_BATCH_BURST)
+MAX_INPUT_CHARS = int(os.getenv("COACH_MAX_INPUT_CHARS", "50000"))
+# 관리자 API 토큰 (없으면 관리자 API는 꺼짐)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# 속도 제한을 따로 받을 클라이언트용 API 키 (쉼표 구분, X-Api-Key 헤더로 보냄 → 키별로 제한, 없으면 IP별)
+RATE_LIMIT_API_KEYS = {hashlib.sha256(k.strip().encode()).hexdigest()
+                       for k in os.getenv("RATE_LIMIT_API_KEYS", "").split(",") if k.strip()}
+# 앞단 프록시 IP (쉼표 구분) → 이 주소에서 온 요청만 X-Forwarded-For를 믿음
+TRUSTED_PROXIES = {p.strip() for p in os.getenv("TRUSTED_PROXIES", "").split(",") if p.strip()}
+
+# 1. AI 로드는 서버가 뜬 뒤 백그라운드에서 (준비될 때까지 /readyz와 코칭 API는 503)
+ai_system = None
+startup_state = {"ready": False, "error": None, "import_seconds": None, "startup_seconds": None}
 
-# 1. 앱 초기화
-app = FastAPI()
+
+def load_system():
+    """무거운 import(chromadb, LLM SDK) + 임베딩 모델 워밍업 + 지식 베이스 동기화"""
+    global ai_system
+    started = time.perf_counter()
+    try:
+        from rag_system import CareerAI
+        ai = CareerAI()
+        if not hasattr(ai, "collection"):
+            raise RuntimeError("API 키가 없습니다.")
+        ai.load_data(CAREER_TIPS)
+        ai_system = ai
+        startup_state["ready"] = True
+    except Exception as e:
+        startup_state["error"] = str(e)
+        print(f"AI 시스템 로드 실패: {e}")
+    startup_state["startup_seconds"] = round(time.perf_counter() - started, 3)
+    print(f"시작 시간: import {startup_state['import_seconds']}s, AI 로드 {startup_state['startup_seconds']}s")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    init_user_db()
+    # 로드를 기다리지 않고 바로 요청을 받음 (/healthz는 즉시 응답)
+    loader = asyncio.create_task(asyncio.to_thread(load_system))
+    yield
+    # 백그라운드 큐에 남은 대화 기록을 모두 저장하고 종료
+    shutdown_user_db()
+    if not loader.done():
+        print("AI 로드가 끝나기 전에 종료됩니다.")
+
+
+app = FastAPI(lifespan=lifespan)
 
 # 2. CORS 설정 (Next.js인 localhost:3000 접속 허용 필수!)
 origins = [
@@ -21,19 +82,232 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 3. AI 로드
-ai_system = CareerAI()
-ai_system.load_data(CAREER_TIPS)
+# 클라이언트별 요청 속도 제한 (RATE_LIMIT_PER_MINUTE=0이면 끔), 배치는 글 수 기준으로 따로 제한
+rate_limiter = RateLimiter()
+batch_rate_limiter = RateLimiter(RATE_LIMIT_BATCH_PER_MINUTE, RATE_LIMIT_BATCH_BURST)
+# 부하 테스트 재생용 요청 기록 (RECORD_REQUESTS_PATH가 있을 때만, 익명화해서 저장)
+recorder = TrafficRecorder()
+
+
+def client_ip(http_request):
+    """
+    요청을 보낸 IP (직접 연결한 곳이 TRUSTED_PROXIES면 X-Forwarded-For에서 찾음)
+    X-Forwarded-For 앞부분은 클라이언트가 마음대로 넣을 수 있으므로, 뒤에서부터 신뢰하는 프록시가 아닌 첫 주소를 씀
+    """
+    peer = http_request.client.host if http_request.client else "-"
+    if peer not in TRUSTED_PROXIES:
+        return peer
+    forwarded = [a.strip() for a in http_request.headers.get("x-forwarded-for", "").split(",") if a.strip()]
+    for address in reversed(forwarded):
+        if address not in TRUSTED_PROXIES:
+            return address
+    return peer
+
+
+def client_id(http_request):
+    """등록된 API 키를 보내면 키별, 아니면 IP별 (클라이언트가 고른 값은 믿지 않음)"""
+    key = http_request.headers.get("x-api-key")
+    if key:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        if digest in RATE_LIMIT_API_KEYS:
+            return "key:" + digest[:16]
+    return "ip:" + client_ip(http_request)
+
+
+def check_rate_limit(http_request, cost=1, limiter=rate_limiter):
+    """클라이언트별 속도 제한 → 초과 시 429"""
+    if not limiter.allows(cost):
+        raise HTTPException(status_code=429,
+                            detail=f"한 번에 최대 {limiter.burst}개까지만 요청할 수 있습니다. 나눠서 보내주세요.")
+    retry_after = limiter.acquire(client_id(http_request), cost)
+    if retry_after is not None:
+        raise HTTPException(status_code=429, detail="요청이 너무 잦습니다. 잠시 후 다시 시도해주세요.",
+                            headers={"Retry-After": str(retry_after)})
+
+
+def overloaded(error):
+    return HTTPException(status_code=429, detail=str(error), headers={"Retry-After": str(error.retry_after)})
+
+
+def require_ai():
+    """준비가 안 됐으면 503 (로드밸런서가 다른 워커로 보내도록)"""
+    if ai_system is None:
+        detail = startup_state["error"] or "AI 시스템을 불러오는 중입니다."
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": "5"})
+    return ai_system
 
 class ChatRequest(BaseModel):
-    user_input: str
+    user_input: str = Field(max_length=MAX_INPUT_CHARS)
+    mode: Optional[Literal["fast", "two_stage"]] = None  # 없으면 COACH_PIPELINE_MODE 사용
+    trace: bool = False  # True면 단계별 소요 시간도 응답에 포함
+    session_id: Optional[str] = None  # 같은 값을 보내면 이전 대화를 이어서 상담
+
+class BatchRequest(BaseModel):
+    texts: list[Annotated[str, Field(max_length=MAX_INPUT_CHARS)]] = Field(max_length=BATCH_MAX_TEXTS)
+    mode: Optional[Literal["fast", "two_stage"]] = None
 
 @app.post("/api/coach")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, response: Response, http_request: Request):
+    ai = require_ai()
+    recorder.record("/api/coach", request.user_input, request.mode, request.session_id, client_id(http_request))
+    check_rate_limit(http_request)
+    trace_id = start_trace("/api/coach")
+    response.headers["X-Trace-Id"] = trace_id
     try:
-        response_text, sources, draft = ai_system.get_coaching(request.user_input)
-        return {"answer": response_text}
+        response_text, sources, draft, meta = await ai.get_coaching_async(request.user_input, request.mode,
+                                                                          session_id=request.session_id)
+    except Overloaded as e:
+        end_trace()
+        raise overloaded(e)
     except Exception as e:
+        end_trace()
         raise HTTPException(status_code=500, detail=str(e))
 
-# 실행 명령어: uvicorn api:app --reload --port 8000
\ No newline at end of file
+    trace = end_trace()
+    # 기록 저장은 백그라운드 큐로 넘기기만 하고, 실패해도 답변에는 영향 없음
+    save_message(request.user_input, response_text, latency_ms=trace["total_ms"], mode=meta["mode"],
+                 sources=sources, trace_id=trace_id)
+    result = {"answer": response_text, "mode": meta["mode"], "cached": meta["cached"],
+              "degraded": meta.get("degraded", False), "session_id": request.session_id, "trace_id": trace_id}
+    if isinstance(draft, dict):
+        result["structured"] = draft  # fast 모드의 risks/advice/questions
+    if request.trace:
+        result["trace"] = trace
+    return result
+
+@app.post("/api/coach/batch")
+async def chat_batch(request: BatchRequest, http_request: Request):
+    """여러 글을 한 번에 코칭 (결과는 입력 순서, 항목별 error 포함)"""
+    ai = require_ai()
+    check_rate_limit(http_request, cost=len(request.texts), limiter=batch_rate_limiter)
+    start_trace("/api/coach/batch")
+    try:
+        results = await ai.get_coaching_batch_async(request.texts, request.mode)
+        return {"results": results, "trace_id": end_trace()["trace_id"]}
+    except Overloaded as e:
+        end_trace()
+        raise overloaded(e)
+    except Exception as e:
+        end_trace()
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/coach/stream")
+async def chat_stream(request: ChatRequest, http_request: Request):
+    """SSE 스트리밍: sources 이벤트 → mode 이벤트 → token 이벤트들 → done 이벤트"""
+    ai = require_ai()
+    recorder.record("/api/coach/stream", request.user_input, request.mode, request.session_id,
+                    client_id(http_request))
+    check_rate_limit(http_request)
+    trace_id = start_trace("/api/coach/stream")
+
+    # 대기열이 가득 찼는지는 첫 이벤트에서 알 수 있으므로, 응답을 시작하기 전에 받아 둠 (가득 차면 429)
+    events = ai.stream_coaching_async(request.user_input, request.mode, session_id=request.session_id)
+    try:
+        first = await events.__anext__()
+    except Overloaded as e:
+        end_trace()
+        raise overloaded(e)
+    except Exception as e:
+        end_trace()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def all_events():
+        yield first
+        async for event in events:
+            yield event
+
+    async def event_stream():
+        answer, sources, mode = "", [], None
+        async for kind, payload in all_events():
+            if kind == "sources":
+                sources = payload
+            elif kind == "mode":
+                mode = payload
+            elif kind in ("token", "error"):
+                answer += payload
+            yield f"event: {kind}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        trace = end_trace()
+        save_message(request.user_input, answer, latency_ms=trace["total_ms"], mode=mode,
+                     sources=sources, trace_id=trace_id)
+        if request.trace:
+            yield f"event: trace\ndata: {json.dumps(trace, ensure_ascii=False)}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no",
+                                      "X-Trace-Id": trace_id})
+
+@app.delete("/api/session/{session_id}")
+async def reset_session(session_id: str):
+    """대화 세션 초기화 (새 자소서로 처음부터 상담할 때)"""
+    require_ai().sessions.reset(session_id)
+    return {"session_id": session_id, "reset": True}
+
+@app.get("/api/admin/history.csv")
+async def export_history(http_request: Request, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                         search: Optional[str] = None):
+    """대화 기록 CSV 다운로드 (청크 단위로 읽어서 바로 보내므로 전체를 메모리에 올리지 않음)"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="관리자 API가 설정되지 않았습니다.")
+    if not hmac.compare_digest(http_request.headers.get("x-admin-token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="관리자 토큰이 올바르지 않습니다.")
+
+    def chunks():
+        yield "\ufeff"  # 엑셀에서 한글이 깨지지 않도록 BOM
+        yield from iter_history_csv(start_date, end_date, search or None)
+
+    # 동기 제너레이터는 스레드 풀에서 돌므로 DB 읽기가 이벤트 루프를 막지 않음
+    return StreamingResponse(chunks(), media_type="text/csv; charset=utf-8",
+                             headers={"Content-Disposition": 'attachment; filename="user_history.csv"'})
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """응답 캐시 / 질문 임베딩 캐시 적중·미스 카운터"""
+    ai = require_ai()
+    return {**ai.cache.stats(), "embedding": ai.embedding_cache.stats()}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 수집용 (단계별 소요 시간 히스토그램, 요청 수, LLM 토큰 수, 캐시 적중)"""
+    lines = [
+        "# TYPE jobnav_startup_seconds gauge",
+        f'jobnav_startup_seconds{{phase="import"}} {startup_state["import_seconds"] or 0}',
+        f'jobnav_startup_seconds{{phase="load"}} {startup_state["startup_seconds"] or 0}',
+        "# TYPE jobnav_ready gauge",
+        f"jobnav_ready {int(ai_system is not None)}",
+    ]
+    if ai_system is not None:
+        cache = ai_system.cache.stats()
+        embedding_cache = ai_system.embedding_cache.stats()
+        lines += [
+            "# TYPE jobnav_cache_hits_total counter",
+            f"jobnav_cache_hits_total {cache['hits']}",
+            "# TYPE jobnav_cache_misses_total counter",
+            f"jobnav_cache_misses_total {cache['misses']}",
+            "# TYPE jobnav_embedding_cache_hits_total counter",
+            f"jobnav_embedding_cache_hits_total {embedding_cache['hits']}",
+            "# TYPE jobnav_embedding_cache_misses_total counter",
+            f"jobnav_embedding_cache_misses_total {embedding_cache['misses']}",
+        ]
+    return PlainTextResponse(render_prometheus() + "\n".join(lines) + "\n",
+                             media_type="text/plain; version=0.0.4")
+
+@app.get("/healthz")
+async def healthz():
+    """프로세스가 살아 있는지 (AI 로드 여부와 무관하게 즉시 응답)"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz(response: Response):
+    """지식 베이스 로드 + 임베딩 모델 워밍업이 끝났는지"""
+    if ai_system is None:
+        response.status_code = 503
+    return startup_state
+
+# import에 걸린 시간 (uvicorn이 이 모듈을 불러오는 데 걸린 시간)
+startup_state["import_seconds"] = round(time.perf_counter() - _IMPORT_STARTED, 3)
+
+# 실행 명령어: uvicorn api:app --reload --port 8000
+# 여러 워커로 실행 (지식 베이스는 Chroma 서버 하나가 관리, 팁 추가는 KNOWLEDGE_POLL_SECONDS 안에 모든 워커에 반영):
+#   chroma run --path ./chroma_db --port 8001
+#   CHROMA_HOST=localhost CHROMA_PORT=8001 uvicorn api:app --workers 4 --port 8000
\ No newline at end of file
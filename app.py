@@ -3,10 +3,12 @@ from rag_system import CareerAI
 from career_data import CAREER_TIPS
 # 구글 시트 로거 대신 에러 방지를 위해 로컬 DB만 사용하는 설정으로 변경할 수도 있으나, 
 # 일단 기존 import 유지하되 try-except로 감쌉니다.
-from user_db import init_user_db, save_message, get_all_history 
+from user_db import init_user_db, save_message, query_history, history_stats, iter_history_csv
 from file_utils import extract_text_from_file
 import time
 import os
+import datetime
+import uuid
 
 # -------------------------------------------------------------------------
 # 1. 기본 설정
@@ -153,6 +155,9 @@ tab1, tab2 = st.tabs(["📝 자소서 첨삭", "⚙️ 관리자"])
 with tab1:
     if "messages" not in st.session_state:
         st.session_state.messages = [{"role": "assistant", "content": "안녕하세요! 자소서 내용을 입력해주시면 분석해 드립니다."}]
+    # 이어지는 질문에서 이전 대화 맥락(요약 + 최근 대화)을 쓰기 위한 세션
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
 
     for msg in st.session_state.messages:
         avatar = "🎓" if msg["role"] == "assistant" else None
@@ -169,19 +174,28 @@ with tab1:
         safe_log("User", "REQ_COACHING", prompt[:30])
 
         with st.chat_message("assistant", avatar="🎓"):
+            started = time.perf_counter()
             with st.status("분석 중...", expanded=True) as status:
                 st.write("🔍 데이터베이스 조회...")
-                time.sleep(0.5)
-                
-                response_text, sources, draft_text = ai_system.get_coaching(prompt)
-                
+                events = ai_system.stream_coaching(prompt, session_id=st.session_state.session_id)
+                _, sources = next(events)
+                for source in sources:
+                    st.caption(f"📚 {source}")
                 st.write("✨ 답변 작성 중...")
-                time.sleep(0.5)
-                status.update(label="완료!", state="complete", expanded=False)
 
-            st.markdown(response_text)
+            # 상담 단계 토큰이 도착하는 대로 바로 화면에 출력
+            served = {}
+            def answer_tokens():
+                for kind, payload in events:
+                    if kind == "mode":
+                        served["mode"] = payload
+                    elif kind in ("token", "error"):
+                        yield payload
+            response_text = st.write_stream(answer_tokens())
+            status.update(label="완료!", state="complete", expanded=False)
 
-        save_message(prompt, response_text)
+        save_message(prompt, response_text, latency_ms=(time.perf_counter() - started) * 1000,
+                     mode=served.get("mode"), sources=sources)
         st.session_state.messages.append({"role": "assistant", "content": response_text})
         
         scroll_to_bottom()
@@ -212,10 +226,59 @@ with tab2:
 
         st.divider()
 
-        # 사용자 데이터
+        # 사용자 데이터 (전체를 읽지 않고 페이지 단위로 조회)
         st.markdown("##### 📥 사용자 데이터")
-        history_df = get_all_history()
-        st.dataframe(history_df, use_container_width=True)
+        today = datetime.date.today()
+        col1, col2, col3 = st.columns([2, 2, 1])
+        with col1:
+            date_range = st.date_input("기간", (today - datetime.timedelta(days=30), today))
+        with col2:
+            search = st.text_input("검색", placeholder="질문/답변 내용 검색").strip()
+        with col3:
+            page_size = st.selectbox("페이지 크기", [20, 50, 100], index=1)
+        # 날짜를 하나만 고른 상태면 그 하루만
+        start_date = date_range[0] if date_range else None
+        end_date = date_range[-1] if date_range else None
+
+        # 조건이 바뀌면 첫 페이지부터
+        filters = (start_date, end_date, search, page_size)
+        if st.session_state.get("history_filters") != filters:
+            st.session_state.history_filters = filters
+            st.session_state.history_cursors = [None]
+        cursors = st.session_state.history_cursors
+
+        rows, next_before_id = query_history(limit=page_size, before_id=cursors[-1],
+                                             start_date=start_date, end_date=end_date, search=search or None)
+        st.dataframe(rows, use_container_width=True)
+
+        col1, col2, col3 = st.columns([1, 1, 3])
+        with col1:
+            if st.button("◀ 이전", disabled=len(cursors) == 1):
+                cursors.pop()
+                st.rerun()
+        with col2:
+            if st.button("다음 ▶", disabled=next_before_id is None):
+                cursors.append(next_before_id)
+                st.rerun()
+        with col3:
+            st.caption(f"{len(cursors)} 페이지")
+
+        # 일별 요청 수 / 평균 답변 길이 (SQL에서 집계)
+        stats = history_stats(start_date, end_date)
+        if stats:
+            total = sum(day["requests"] for day in stats)
+            avg_length = sum(day["avg_response_length"] * day["requests"] for day in stats) / total
+            col1, col2 = st.columns(2)
+            col1.metric("요청 수", total)
+            col2.metric("평균 답변 길이", f"{avg_length:.0f}자")
+            st.bar_chart({day["day"]: day["requests"] for day in stats})
+
+        # 내보내기는 버튼을 눌렀을 때만 생성하고 세션에 보관하지 않음 (다음 화면 갱신 때 메모리에서 사라짐)
+        # 기간이 길면 API 서버의 GET /api/admin/history.csv (ADMIN_TOKEN 필요)로 스트리밍 다운로드
+        if st.button("📄 CSV 만들기"):
+            st.download_button("⬇️ CSV 다운로드",
+                               "".join(iter_history_csv(start_date, end_date, search or None)).encode("utf-8-sig"),
+                               file_name="user_history.csv", mime="text/csv")
         
         st.divider()
         
@@ -0,0 +1,314 @@
+# benchmark.py
+# 코칭 파이프라인 / API / 데이터 적재 성능 측정 (기본은 스텁 LLM이라 API 키·네트워크 없이 실행 가능)
+#
+# 사용법:
+#   python benchmark.py                                   # 기본 설정 전체 실행
+#   python benchmark.py --targets coaching,api --concurrency 1,8,32 --corpus 100,1000 --requests 64
+#   python benchmark.py --backend gemini --targets coaching --requests 5   # 실제 Gemini로 측정
+#   python benchmark.py --json bench_output.json          # 결과를 JSON으로 저장
+# (api 측정에는 httpx 필요: pip install httpx)
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+import functools
+import tracemalloc
+from collections import defaultdict
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(latencies):
+    return {
+        "count": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def make_corpus(size):
+    """CAREER_TIPS를 변형해서 원하는 크기의 가짜 지식 베이스 생성"""
+    from career_data import CAREER_TIPS
+    corpus = []
+    for i in range(size):
+        base = CAREER_TIPS[i % len(CAREER_TIPS)]
+        corpus.append({
+            "category": base["category"],
+            "source": f"{base['source']} #{i}",
+            "content": f"{base['content']} (사례 {i})",
+        })
+    return corpus
+
+
+QUERIES = [
+    "비전공자인데 개발자 면접에서 코딩 실력을 어떻게 증명하죠?",
+    "GA4로 마케팅 데이터를 분석한 경험을 자소서에 어떻게 써야 할까요?",
+    "Figma로 만든 포트폴리오 기여도를 어떻게 설명하면 좋을까요?",
+    "공백기가 1년 있는데 면접에서 뭐라고 답해야 하나요?",
+    "지원동기를 귀사의 비전이 좋아서라고 썼는데 괜찮을까요?",
+]
+
+
+def query(i):
+    # 캐시에 걸리지 않도록 매번 조금씩 다른 질문
+    return f"{QUERIES[i % len(QUERIES)]} (요청 {i})"
+
+
+# 단계별 메모리 측정이 tracemalloc.reset_peak를 쓰므로, 그 전까지의 최대값은 여기에 합쳐 둠
+_memory = {"peak": 0}
+_memory_lock = threading.Lock()
+
+
+def _fold_peak():
+    _memory["peak"] = max(_memory["peak"], tracemalloc.get_traced_memory()[1])
+
+
+def _stage_memory_start():
+    if not tracemalloc.is_tracing():
+        return None
+    with _memory_lock:
+        _fold_peak()
+        tracemalloc.reset_peak()
+        return tracemalloc.get_traced_memory()[0]
+
+
+def _stage_memory_end(start):
+    """단계 시작 시점 대비 최대 증가량(MB) (동시 실행 중이면 다른 요청의 할당도 섞임)"""
+    if start is None:
+        return None
+    with _memory_lock:
+        peak = tracemalloc.get_traced_memory()[1]
+        _fold_peak()
+    return (peak - start) / 1024 / 1024
+
+
+def instrument(ai, stage_times, stage_memory):
+    """CareerAI 인스턴스의 단계별 메서드를 감싸서 소요 시간과 최대 메모리 기록"""
+    def record(stage, start, memory_start):
+        stage_times[stage].append(time.perf_counter() - start)
+        memory = _stage_memory_end(memory_start)
+        if memory is not None:
+            stage_memory[stage].append(memory)
+
+    stages = {"_cache_embedding": "embed", "_retrieve_stage": "retrieve", "_run_stages": "llm"}
+    for method, stage in stages.items():
+        original = getattr(ai, method)
+
+        @functools.wraps(original)
+        def timed(*args, _original=original, _stage=stage, **kwargs):
+            memory_start = _stage_memory_start()
+            start = time.perf_counter()
+            try:
+                return _original(*args, **kwargs)
+            finally:
+                record(_stage, start, memory_start)
+        setattr(ai, method, timed)
+
+    original_async = ai._run_stages_async
+
+    @functools.wraps(original_async)
+    async def timed_async(*args, **kwargs):
+        memory_start = _stage_memory_start()
+        start = time.perf_counter()
+        try:
+            return await original_async(*args, **kwargs)
+        finally:
+            record("llm", start, memory_start)
+    ai._run_stages_async = timed_async
+
+
+def stage_rows(stage_times, stage_memory):
+    return {stage: {**summarize(times), "peak_memory_mb": max(stage_memory.get(stage) or [0.0])}
+            for stage, times in stage_times.items()}
+
+
+async def run_concurrently(make_call, total, concurrency):
+    """concurrency개의 작업자가 total개의 요청을 나눠서 처리 → (지연 시간 목록, 에러 목록, 전체 소요 시간)"""
+    latencies, errors = [], []
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                await make_call(i)
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                errors.append(type(e).__name__)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies, errors, time.perf_counter() - start
+
+
+def measure(track_memory):
+    """with 블록 구간의 최대 메모리(MB) 측정용"""
+    class Measure:
+        peak_mb = 0.0
+
+        def __enter__(self):
+            if track_memory:
+                with _memory_lock:
+                    tracemalloc.reset_peak()
+                    _memory["peak"] = 0
+            return self
+
+        def __exit__(self, *exc):
+            if track_memory:
+                with _memory_lock:
+                    _fold_peak()
+                    self.peak_mb = _memory["peak"] / 1024 / 1024
+    return Measure()
+
+
+def report(rows):
+    header = f"{'target':<10}{'corpus':>8}{'conc':>6}{'n':>6}{'err':>5}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'mem MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['target']:<10}{row['corpus']:>8}{row['concurrency']:>6}{row['count']:>6}{row['errors']:>5}"
+              f"{row['throughput_rps']:>9.1f}{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}"
+              f"{row['peak_memory_mb']:>9.1f}")
+        for stage, stats in row.get("stages", {}).items():
+            print(f"{'':<10}  └ {stage:<12} n={stats['count']:<6} p50={stats['p50_ms']:.1f}ms "
+                  f"p95={stats['p95_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms mem={stats['peak_memory_mb']:.1f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Job-Navigator 성능 측정")
+    parser.add_argument("--targets", default="ingest,coaching,api")
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--corpus", default="100,1000")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--mode", default="two_stage", choices=["fast", "two_stage"])
+    parser.add_argument("--backend", default="stub", choices=["stub", "gemini"])
+    parser.add_argument("--stub-latency", default="0.2")
+    parser.add_argument("--stub-tokens", default="200")
+    parser.add_argument("--no-memory", action="store_true", help="tracemalloc 끄기 (오버헤드 제거)")
+    parser.add_argument("--json", help="결과를 저장할 JSON 파일 경로")
+    args = parser.parse_args()
+
+    # rag_system import 전에 환경 설정 (별도 DB, 응답/임베딩 캐시 끔)
+    base_dir = tempfile.mkdtemp(prefix="bench_chroma_")
+    os.environ["LLM_BACKEND"] = args.backend
+    os.environ["STUB_LLM_LATENCY"] = args.stub_latency
+    os.environ["STUB_LLM_TOKENS"] = args.stub_tokens
+    os.environ["CHROMA_PATH"] = os.path.join(base_dir, "default")
+    os.environ["COACH_CACHE_PERSIST"] = "0"
+    os.environ["COACH_CACHE_THRESHOLD"] = "2"
+    # 임베딩 캐시도 끔 (동시성 단계마다 같은 질문이 반복되므로 측정이 왜곡됨)
+    os.environ["EMBED_CACHE_SIZE"] = "0"
+    # 모든 요청이 한 클라이언트에서 오므로 속도 제한 끔
+    os.environ["RATE_LIMIT_PER_MINUTE"] = "0"
+
+    import rag_system
+    from rag_system import CareerAI
+    from admission import AdmissionQueue
+
+    targets = args.targets.split(",")
+    concurrencies = [int(c) for c in args.concurrency.split(",")]
+    track_memory = not args.no_memory
+    if track_memory:
+        tracemalloc.start()
+
+    rows = []
+    for corpus_size in [int(c) for c in args.corpus.split(",")]:
+        rag_system.CHROMA_PATH = os.path.join(base_dir, f"corpus_{corpus_size}")
+        corpus = make_corpus(corpus_size)
+
+        with measure(track_memory) as mem:
+            start = time.perf_counter()
+            ai = CareerAI()
+            startup = time.perf_counter() - start
+        if not hasattr(ai, "collection"):
+            sys.exit("LLM을 사용할 수 없습니다 (GOOGLE_API_KEY 또는 --backend stub 필요)")
+
+        if "ingest" in targets:
+            for label, call in (("full", lambda: ai.load_data(corpus)),
+                                ("noop", lambda: ai.load_data(corpus))):
+                with measure(track_memory) as mem:
+                    start = time.perf_counter()
+                    call()
+                    elapsed = time.perf_counter() - start
+                rows.append({"target": f"ingest-{label}", "corpus": corpus_size, "concurrency": 1,
+                             "errors": 0, "throughput_rps": corpus_size / elapsed if elapsed else 0.0,
+                             **summarize([elapsed]), "count": corpus_size, "peak_memory_mb": mem.peak_mb,
+                             "startup_ms": startup * 1000})
+        else:
+            ai.load_data(corpus)
+
+        stage_times, stage_memory = defaultdict(list), defaultdict(list)
+        instrument(ai, stage_times, stage_memory)
+
+        if "coaching" in targets:
+            for concurrency in concurrencies:
+                stage_times.clear()
+                stage_memory.clear()
+
+                async def call(i):
+                    answer, sources, draft, meta = await ai.get_coaching_async(query(i), args.mode)
+                    if draft is None:
+                        raise RuntimeError(answer)
+
+                # asyncio.Semaphore는 처음 사용한 이벤트 루프에 묶이므로 실행마다 새로 만듦
+                ai.admission = AdmissionQueue(rag_system.MAX_CONCURRENCY)
+                ai.section_slots = asyncio.Semaphore(rag_system.MAX_CONCURRENCY)
+                with measure(track_memory) as mem:
+                    latencies, errors, elapsed = asyncio.run(run_concurrently(call, args.requests, concurrency))
+                rows.append({"target": "coaching", "corpus": corpus_size, "concurrency": concurrency,
+                             "errors": len(errors), "throughput_rps": len(latencies) / elapsed,
+                             **summarize(latencies), "peak_memory_mb": mem.peak_mb,
+                             "stages": stage_rows(stage_times, stage_memory)})
+
+        if "api" in targets:
+            import httpx
+            import api
+            import user_db
+            api.ai_system = ai
+            # ASGITransport는 lifespan을 실행하지 않으므로 대화 기록 DB는 직접 준비 (실제 기록 DB와 분리)
+            user_db.DB_NAME = os.path.join(base_dir, "user_history.db")
+            user_db.init_user_db()
+
+            for concurrency in concurrencies:
+                stage_times.clear()
+                stage_memory.clear()
+
+                async def run_api():
+                    transport = httpx.ASGITransport(app=api.app)
+                    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+                        async def call(i):
+                            response = await client.post("/api/coach", json={"user_input": query(i), "mode": args.mode})
+                            response.raise_for_status()
+                        return await run_concurrently(call, args.requests, concurrency)
+
+                ai.admission = AdmissionQueue(rag_system.MAX_CONCURRENCY)
+                ai.section_slots = asyncio.Semaphore(rag_system.MAX_CONCURRENCY)
+                with measure(track_memory) as mem:
+                    latencies, errors, elapsed = asyncio.run(run_api())
+                rows.append({"target": "api", "corpus": corpus_size, "concurrency": concurrency,
+                             "errors": len(errors), "throughput_rps": len(latencies) / elapsed,
+                             **summarize(latencies), "peak_memory_mb": mem.peak_mb,
+                             "stages": stage_rows(stage_times, stage_memory)})
+
+    if "api" in targets:
+        import user_db
+        user_db.shutdown()
+    report(rows)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# category_router.py
+# LLM 호출 없이 질문을 카테고리로 분류해서 검색 범위를 줄이는 라우터
+# (키워드 규칙 + 카테고리별 임베딩 평균(centroid)과의 유사도)
+import threading
+import numpy as np
+from keyword_index import WORD_PATTERN
+
+# 질문에 이 단어가 들어 있으면 해당 카테고리를 확실하게 포함
+# (영문은 단어 단위로, 한글은 부분 문자열로 비교)
+KEYWORD_RULES = {
+    "면접질문": ["면접", "자기소개", "공백기", "압박"],
+    "첨삭예시": ["첨삭", "고쳐", "수정", "bad", "good"],
+    "합격자소서": ["합격", "합격자"],
+    "작성법": ["작성법", "star", "두괄식", "소제목", "쓰는 법", "어떻게 써"],
+    "취업고민": ["고민", "걱정", "불안", "비전공", "막막"],
+    "직무역량_개발": ["개발자", "백엔드", "프론트", "코딩", "github", "docker", "aws", "react", "spring"],
+    "직무역량_마케팅": ["마케터", "마케팅", "ga4", "roas", "kpi", "퍼포먼스"],
+    "직무역량_디자인": ["디자이너", "figma", "ui", "ux", "포트폴리오"],
+}
+
+
+class CategoryRouter:
+    def __init__(self, min_similarity=0.3, margin=0.05):
+        self.min_similarity = min_similarity  # 1등 카테고리 유사도가 이보다 낮으면 전체 검색
+        self.margin = margin                  # 1등과 2등 차이가 이보다 작으면 애매하므로 전체 검색
+        self.sums = {}     # category -> 정규화된 임베딩 합
+        self.counts = {}   # category -> 문서 수
+        self._centroids = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding):
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def rebuild(self, embeddings, metadatas):
+        """새 합계를 따로 만든 뒤 한 번에 교체 (만드는 동안에도 라우팅은 이전 값으로 계속됨)"""
+        fresh = CategoryRouter(self.min_similarity, self.margin)
+        for embedding, metadata in zip(embeddings, metadatas):
+            fresh.add(embedding, metadata)
+        with self._lock:
+            self.sums, self.counts = fresh.sums, fresh.counts
+            self._centroids = None
+
+    def add(self, embedding, metadata):
+        category = (metadata or {}).get("category")
+        if not category or embedding is None:
+            return
+        with self._lock:
+            vec = self._normalize(embedding)
+            self.sums[category] = self.sums.get(category, 0) + vec
+            self.counts[category] = self.counts.get(category, 0) + 1
+            self._centroids = None
+
+    def remove(self, embedding, metadata):
+        category = (metadata or {}).get("category")
+        if category not in self.counts or embedding is None:
+            return
+        with self._lock:
+            self.sums[category] = self.sums[category] - self._normalize(embedding)
+            self.counts[category] -= 1
+            if self.counts[category] <= 0:
+                del self.sums[category], self.counts[category]
+            self._centroids = None
+
+    def _centroid_matrix(self):
+        if self._centroids is None:
+            names = list(self.sums)
+            matrix = np.stack([self._normalize(self.sums[name]) for name in names]) if names else None
+            self._centroids = (names, matrix)
+        return self._centroids
+
+    def route(self, text, embedding):
+        """
+        질문이 속할 카테고리 목록 반환
+        확신이 없으면 None (→ 전체 검색)
+        """
+        lowered = text.lower()
+        ascii_words = set(WORD_PATTERN.findall(lowered))
+        with self._lock:
+            known = set(self.counts)
+            names, matrix = self._centroid_matrix()
+
+        categories = [c for c, words in KEYWORD_RULES.items()
+                      if c in known and any(word in ascii_words if word.isascii() else word in lowered
+                                            for word in words)]
+
+        if matrix is not None:
+            sims = matrix @ self._normalize(embedding)
+            order = np.argsort(sims)[::-1]
+            top = float(sims[order[0]])
+            second = float(sims[order[1]]) if len(order) > 1 else -1.0
+            if top >= self.min_similarity and top - second >= self.margin and names[order[0]] not in categories:
+                categories.append(names[order[0]])
+
+        return categories or None
+
+
+def category_filter(categories):
+    """Chroma where 필터로 변환"""
+    if not categories:
+        return None
+    if len(categories) == 1:
+        return {"category": categories[0]}
+    return {"category": {"$in": list(categories)}}
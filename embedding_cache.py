@@ -0,0 +1,146 @@
+# embedding_cache.py
+# 질문 임베딩 캐시: 같은 글(공백 정리 후)이면 ONNX 임베딩 모델을 다시 돌리지 않음
+# 메모리 LRU + SQLite 디스크 저장 (재시작 후에도 유지, 여러 워커가 같은 파일 공유 가능)
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# 디스크 저장 위치 (빈 값이면 메모리에만 보관), 메모리 LRU 크기 (0이면 캐시 끔), 디스크 최대 개수
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "./embedding_cache.db")
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "2048"))
+EMBED_CACHE_MAX_ROWS = int(os.getenv("EMBED_CACHE_MAX_ROWS", "100000"))
+
+
+def normalize_text(text):
+    """공백 차이만 있는 글은 같은 글로 취급"""
+    return " ".join(text.split())
+
+
+class EmbeddingCache:
+    def __init__(self, model_name, max_size=EMBED_CACHE_SIZE, path=EMBED_CACHE_PATH,
+                 max_rows=EMBED_CACHE_MAX_ROWS):
+        self.model_name = model_name  # 모델이 바뀌면 키도 달라지도록 해시에 포함
+        self.max_size = max_size
+        self.max_rows = max_rows
+        self.entries = OrderedDict()  # key -> np.ndarray(float32)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._inserted = 0  # 마지막 정리 이후 디스크에 추가한 개수
+        if path and max_size > 0:
+            try:
+                self._conn = sqlite3.connect(path, check_same_thread=False)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("PRAGMA synchronous=NORMAL")
+                self._conn.execute('''
+                    CREATE TABLE IF NOT EXISTS embeddings (
+                        key TEXT PRIMARY KEY,
+                        vector BLOB,
+                        last_used REAL
+                    )
+                ''')
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"임베딩 캐시 DB 열기 실패, 메모리 캐시만 사용: {e}")
+                self._conn = None
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\n{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector):
+        self.entries[key] = vector
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def embed(self, texts, embed_fn):
+        """
+        texts의 임베딩 목록 반환 (입력 순서 유지)
+        캐시에 없는 글만 모아서 embed_fn을 한 번 호출
+        """
+        if self.max_size <= 0:
+            return [np.asarray(v, dtype=np.float32) for v in embed_fn(list(texts))]
+
+        normalized = [normalize_text(text) for text in texts]
+        keys = [self._key(text) for text in normalized]
+        results = [None] * len(texts)
+        now = time.time()
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    results[i] = self.entries[key]
+            missing = list({keys[i] for i in range(len(keys)) if results[i] is None})
+            if missing and self._conn is not None:
+                # 디스크 캐시를 못 읽으면 (다른 워커가 잠금 중, 파일 손상 등) 없는 것으로 보고 새로 계산
+                try:
+                    placeholders = ",".join("?" * len(missing))
+                    rows = self._conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", missing).fetchall()
+                    for key, blob in rows:
+                        self._remember(key, np.frombuffer(blob, dtype=np.float32))
+                    if rows:
+                        self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                               [(now, key) for key, _ in rows])
+                        self._conn.commit()
+                except sqlite3.Error as e:
+                    print(f"임베딩 캐시 읽기 실패: {e}")
+                    try:
+                        self._conn.rollback()
+                    except sqlite3.Error:
+                        pass
+            for i, key in enumerate(keys):
+                if results[i] is None and key in self.entries:
+                    results[i] = self.entries[key]
+
+            # 같은 글이 여러 번 있어도 한 번만 계산
+            todo = {}
+            for i, key in enumerate(keys):
+                if results[i] is None:
+                    todo.setdefault(key, normalized[i])
+            self.hits += len(texts) - sum(1 for r in results if r is None)
+            self.misses += len(todo)
+        if not todo:
+            return results
+
+        # 모델 실행은 잠금 밖에서
+        vectors = [np.asarray(v, dtype=np.float32) for v in embed_fn(list(todo.values()))]
+        computed = dict(zip(todo.keys(), vectors))
+        with self._lock:
+            for key, vector in computed.items():
+                self._remember(key, vector)
+            if self._conn is not None:
+                try:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                        [(key, vector.tobytes(), now) for key, vector in computed.items()])
+                    self._inserted += len(computed)
+                    if self._inserted >= 256:
+                        self._prune()
+                        self._inserted = 0
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    print(f"임베딩 캐시 저장 실패: {e}")
+        return [r if r is not None else computed[keys[i]] for i, r in enumerate(results)]
+
+    def _prune(self):
+        """디스크 캐시가 max_rows를 넘으면 오래 안 쓴 항목부터 삭제"""
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count > self.max_rows:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (count - self.max_rows,))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -1,31 +1,123 @@
 # file_utils.py (새로 만들기)
 from pypdf import PdfReader
 from docx import Document
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import tempfile
+from text_utils import chunk_resume  # 예전 import 경로 유지
+from metrics import stage_timer
 import io
+import os
 
-def extract_text_from_file(uploaded_file):
+# 추출할 최대 글자 수 (이 이상은 프롬프트에 넣어도 의미가 없고 메모리만 씀)
+MAX_EXTRACT_CHARS = int(os.getenv("MAX_EXTRACT_CHARS", "50000"))
+# 이 페이지 수 이상인 PDF는 여러 프로세스로 나눠서 파싱
+PARALLEL_PDF_PAGES = int(os.getenv("PARALLEL_PDF_PAGES", "20"))
+PDF_PAGES_PER_TASK = 8
+# PDF 파싱용 프로세스 수 (모든 파일이 같은 풀을 같이 씀)
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_pdf_pool = None
+# (워커 프로세스 안에서) 마지막으로 연 PDF → 같은 파일의 다음 묶음은 다시 파싱하지 않음
+_worker_reader = (None, None)
+
+
+def _get_pdf_pool():
+    global _pdf_pool
+    if _pdf_pool is None:
+        # 이 프로세스에는 이미 여러 스레드(서버, onnxruntime, DB/캐시 저장 스레드)가 있어서
+        # fork하면 잠금을 쥔 상태가 복사되어 자식이 멈출 수 있으므로 spawn 사용
+        _pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pdf_pool
+
+
+def _file_bytes(uploaded_file):
+    if hasattr(uploaded_file, "getvalue"):
+        return uploaded_file.getvalue()
+    return uploaded_file.read()
+
+
+def _extract_pdf_pages(path, start, end):
+    """(프로세스 풀 작업) 임시 파일의 PDF에서 start~end-1 페이지 텍스트 추출"""
+    global _worker_reader
+    if _worker_reader[0] != path:
+        _worker_reader = (path, PdfReader(path))
+    reader = _worker_reader[1]
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def _iter_pdf_pages(data):
+    reader = PdfReader(io.BytesIO(data))
+    page_count = len(reader.pages)
+    if page_count < PARALLEL_PDF_PAGES:
+        for page in reader.pages:
+            yield page.extract_text() or ""
+        return
+
+    # 큰 PDF: 페이지 묶음별로 나눠서 병렬 파싱
+    # 워커 수만큼만 미리 맡기고 앞 묶음부터 순서대로 내보냄 (중간에 멈추면 남은 묶음은 맡기지 않음)
+    # 바이트는 작업마다 넘기지 않고 임시 파일로 한 번만 저장 (워커는 파일을 한 번 열어서 재사용)
+    del reader
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(data)
+        path = f.name
+    pool = _get_pdf_pool()
+    pending = deque()
+    try:
+        for start in range(0, page_count, PDF_PAGES_PER_TASK):
+            pending.append(pool.submit(_extract_pdf_pages, path, start,
+                                       min(start + PDF_PAGES_PER_TASK, page_count)))
+            if len(pending) >= PDF_WORKERS:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        os.remove(path)
+
+
+def iter_text_segments(uploaded_file, max_chars=MAX_EXTRACT_CHARS):
+    """
+    업로드된 파일(PDF, DOCX, TXT)을 페이지/문단 단위로 하나씩 내보내는 제너레이터
+    {"index": 번호, "offset": 전체 텍스트에서의 시작 위치, "text": 내용}
+    max_chars를 넘으면 거기서 잘라내고 멈춤
+    """
+    name = uploaded_file.name.lower()
+    if name.endswith('.pdf'):
+        segments = _iter_pdf_pages(_file_bytes(uploaded_file))
+    elif name.endswith('.docx'):
+        doc = Document(io.BytesIO(_file_bytes(uploaded_file)))
+        segments = (para.text for para in doc.paragraphs)
+    elif name.endswith('.txt'):
+        segments = io.StringIO(_file_bytes(uploaded_file).decode("utf-8"))
+    else:
+        return
+
+    offset = 0
+    try:
+        for index, text in enumerate(segments):
+            text = text.rstrip("\n")
+            if offset + len(text) > max_chars:
+                text = text[:max(max_chars - offset, 0)]
+            # 빈 문단도 내보내야 문단 구분(빈 줄)과 offset이 "\n".join 결과와 일치함
+            yield {"index": index, "offset": offset, "text": text}
+            offset += len(text) + 1
+            if offset >= max_chars:
+                return
+    finally:
+        # 글자 수 제한으로 멈추면 아직 파싱 중인 PDF 페이지 묶음도 바로 취소
+        if hasattr(segments, "close"):
+            segments.close()
+
+
+def extract_text_from_file(uploaded_file, max_chars=MAX_EXTRACT_CHARS):
     """업로드된 파일(PDF, DOCX)에서 텍스트만 추출하는 함수"""
-    text = ""
-    
     try:
-        # 1. PDF 파일일 경우
-        if uploaded_file.name.endswith('.pdf'):
-            reader = PdfReader(uploaded_file)
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-                
-        # 2. Word(DOCX) 파일일 경우
-        elif uploaded_file.name.endswith('.docx'):
-            doc = Document(uploaded_file)
-            for para in doc.paragraphs:
-                text += para.text + "\n"
-        
-        # 3. 텍스트 파일일 경우
-        elif uploaded_file.name.endswith('.txt'):
-            stringio = io.StringIO(uploaded_file.getvalue().decode("utf-8"))
-            text = stringio.read()
-            
+        with stage_timer("extract"):
+            parts = [segment["text"] for segment in iter_text_segments(uploaded_file, max_chars)]
     except Exception as e:
         return f"파일 읽기 오류: {e}"
 
-    return text.strip()
\ No newline at end of file
+    return "\n".join(parts).strip()
@@ -0,0 +1,102 @@
+# keyword_index.py
+# 메모리 BM25 키워드 인덱스: GA4, Jira, Figma 같은 툴 이름이나 한국어 키워드가 정확히 겹치는 팁을 찾기 위함
+import re
+import math
+import threading
+from collections import Counter, defaultdict
+
+# 영문/숫자 단어는 통째로, 한글은 글자 2-gram으로 쪼갬 (조사가 붙어도 매칭되게)
+WORD_PATTERN = re.compile(r"[a-z0-9][a-z0-9+#.]*|[가-힣]+")
+
+
+def tokenize(text):
+    tokens = []
+    for word in WORD_PATTERN.findall(text.lower()):
+        if "가" <= word[0] <= "힣":
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens += [word[i:i + 2] for i in range(len(word) - 1)]
+        else:
+            tokens.append(word.rstrip("."))
+    return tokens
+
+
+class KeywordIndex:
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = {}                     # id -> (document, metadata)
+        self.term_freqs = {}               # id -> Counter(token)
+        self.doc_lengths = {}              # id -> 토큰 수
+        self.postings = defaultdict(set)   # token -> {id, ...}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, doc_id, document, metadata):
+        with self._lock:
+            self._remove(doc_id)
+            tf = Counter(tokenize(document))
+            self.docs[doc_id] = (document, metadata)
+            self.term_freqs[doc_id] = tf
+            self.doc_lengths[doc_id] = sum(tf.values())
+            self._total_length += self.doc_lengths[doc_id]
+            for token in tf:
+                self.postings[token].add(doc_id)
+
+    def remove(self, doc_ids):
+        with self._lock:
+            for doc_id in doc_ids:
+                self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        if doc_id not in self.docs:
+            return
+        for token in self.term_freqs[doc_id]:
+            self.postings[token].discard(doc_id)
+            if not self.postings[token]:
+                del self.postings[token]
+        self._total_length -= self.doc_lengths[doc_id]
+        del self.docs[doc_id], self.term_freqs[doc_id], self.doc_lengths[doc_id]
+
+    def rebuild(self, ids, documents, metadatas):
+        """새 인덱스를 따로 만든 뒤 한 번에 교체 (만드는 동안에도 검색은 이전 인덱스로 계속됨)"""
+        fresh = KeywordIndex(self.k1, self.b)
+        for doc_id, document, metadata in zip(ids, documents, metadatas):
+            fresh.add(doc_id, document, metadata)
+        with self._lock:
+            self.docs, self.term_freqs, self.doc_lengths = fresh.docs, fresh.term_freqs, fresh.doc_lengths
+            self.postings, self._total_length = fresh.postings, fresh._total_length
+
+    def search(self, query, k=8, categories=None):
+        """BM25 점수 상위 k개 [(id, 점수), ...] (categories가 있으면 해당 카테고리 문서만)"""
+        with self._lock:
+            n = len(self.docs)
+            if not n:
+                return []
+            avg_length = self._total_length / n
+            scores = defaultdict(float)
+            for token, qtf in Counter(tokenize(query)).items():
+                postings = self.postings.get(token)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id in postings:
+                    if categories and self.docs[doc_id][1].get("category") not in categories:
+                        continue
+                    tf = self.term_freqs[doc_id][token]
+                    norm = tf + self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / norm
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+def reciprocal_rank_fusion(ranked_lists, k=60):
+    """여러 순위 목록을 RRF로 합침 → [(id, 점수), ...] 점수 내림차순"""
+    scores = defaultdict(float)
+    for ranked in ranked_lists:
+        for rank, doc_id in enumerate(ranked, 1):
+            scores[doc_id] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,71 @@
+# knowledge_loader.py
+# list.md에 정리된 수집 데이터를 career_data.py와 같은 형식({"category", "source", "content"})으로 읽어오는 도구
+import os
+import sys
+import json
+
+
+def load_jsonl(path):
+    """한 줄에 하나씩 {"category": ..., "source": ..., "content": ...} 형식의 JSONL 파일 읽기"""
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if not all(item.get(key) for key in ("category", "source", "content")):
+                print(f"⚠️ {path}:{line_no} 필수 항목 누락, 건너뜀")
+                continue
+            items.append({"category": item["category"], "source": item["source"], "content": item["content"]})
+    return items
+
+
+def load_markdown(path):
+    """
+    마크다운 파일 읽기
+    ## 카테고리
+    ### 제목
+    내용 (다음 제목이 나올 때까지)
+    """
+    items = []
+    category, source, lines = None, None, []
+
+    def flush():
+        content = "\n".join(lines).strip()
+        if category and source and content:
+            items.append({"category": category, "source": source, "content": content})
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line.startswith("### "):
+                flush()
+                source, lines = line[4:].strip(), []
+            elif line.startswith("## "):
+                flush()
+                category, source, lines = line[3:].strip(), None, []
+            else:
+                lines.append(line)
+    flush()
+    return items
+
+
+def load_knowledge_file(path):
+    if path.endswith(".jsonl"):
+        return load_jsonl(path)
+    if path.endswith(".md"):
+        return load_markdown(path)
+    raise ValueError(f"지원하지 않는 파일 형식: {path}")
+
+
+if __name__ == "__main__":
+    # 사용법: python knowledge_loader.py data/interview.jsonl data/trend.md
+    from rag_system import CareerAI
+
+    ai = CareerAI()
+    for path in sys.argv[1:]:
+        items = load_knowledge_file(path)
+        # 파일별로 origin을 나눠서, 파일에서 지운 항목만 DB에서도 지워지게 함
+        result = ai.load_data(items, origin=f"file:{os.path.basename(path)}")
+        print(f"{path}: {len(items)}건 읽음 → {result}")
@@ -0,0 +1,389 @@
+# llm_backends.py
+# LLM 호출부를 교체할 수 있게 분리 (Gemini / 오프라인 테스트·벤치마크용 스텁)
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from metrics import count_tokens, RESILIENCE_EVENTS_TOTAL
+
+# "gemini" (기본), "stub" (API 키 없이 동작하는 가짜 LLM), "http" (LLM_HTTP_URL의 HTTP 서버, 부하 테스트용)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-flash-latest")
+LLM_HTTP_URL = os.getenv("LLM_HTTP_URL", "http://127.0.0.1:9100")
+
+# 호출 한 번의 시간 제한(초, 스트리밍은 첫 토큰까지만), 일시적 오류 재시도 횟수, 재시도 대기 기본값(초)
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+# 동기 스트림의 첫 토큰을 동시에 기다릴 수 있는 수 (넘으면 대기 시간도 시간 제한에 포함됨)
+LLM_STREAM_WAITERS = int(os.getenv("LLM_STREAM_WAITERS", "16"))
+
+# 다시 시도하면 성공할 수 있는 오류 (google.api_core.exceptions 이름 기준: 쿼터 초과, 5xx, 시간 초과)
+TRANSIENT_ERRORS = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+                    "DeadlineExceeded"}
+TRANSIENT_STATUS = {429, 500, 502, 503, 504}
+
+
+class LLMHTTPError(Exception):
+    """HTTP 백엔드의 오류 응답"""
+
+    def __init__(self, status_code, message=""):
+        super().__init__(f"LLM 서버 오류 {status_code} {message}".strip())
+        self.status_code = status_code
+
+
+def is_transient(error):
+    return (isinstance(error, TimeoutError) or type(error).__name__ in TRANSIENT_ERRORS
+            or getattr(error, "status_code", None) in TRANSIENT_STATUS)
+
+
+class GeminiBackend:
+    """google-generativeai 래퍼"""
+
+    def __init__(self, model_name=GEMINI_MODEL):
+        import google.generativeai as genai
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        self.model = genai.GenerativeModel(model_name)
+
+    @staticmethod
+    def _config(json_mode):
+        return {"response_mime_type": "application/json"} if json_mode else None
+
+    @staticmethod
+    def _options(timeout):
+        return {"timeout": timeout} if timeout else None
+
+    @staticmethod
+    def _count_usage(response):
+        usage = getattr(response, "usage_metadata", None)
+        if usage:
+            count_tokens(usage.prompt_token_count, usage.candidates_token_count)
+
+    def generate(self, prompt, json_mode=False, timeout=None):
+        response = self.model.generate_content(prompt, generation_config=self._config(json_mode),
+                                               request_options=self._options(timeout))
+        self._count_usage(response)
+        return response.text
+
+    async def generate_async(self, prompt, json_mode=False, timeout=None):
+        response = await self.model.generate_content_async(prompt, generation_config=self._config(json_mode),
+                                                           request_options=self._options(timeout))
+        self._count_usage(response)
+        return response.text
+
+    # 스트리밍에는 timeout을 넘기지 않음: gRPC timeout은 첫 토큰이 아니라 스트림 전체의 기한이라
+    # 길게 이어지는 답변이 중간에 끊김 (첫 토큰 시간 제한은 RetryingBackend가 담당)
+    @staticmethod
+    def _cancel(response):
+        """스트림 응답 밑의 gRPC 호출 취소 (중간에 닫힌 스트림이 서버에서 끝까지 생성되지 않도록)"""
+        cancel = getattr(getattr(response, "_iterator", None), "cancel", None)
+        if cancel is not None:
+            cancel()
+
+    def stream(self, prompt, timeout=None):
+        chunk = None
+        response = self.model.generate_content(prompt, stream=True)
+        try:
+            for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+            # 사용량은 마지막 청크에 누적되어 옴
+            self._count_usage(chunk)
+        finally:
+            self._cancel(response)
+
+    async def stream_async(self, prompt, timeout=None):
+        chunk = None
+        response = await self.model.generate_content_async(prompt, stream=True)
+        try:
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+            self._count_usage(chunk)
+        finally:
+            self._cancel(response)
+
+
+class StubBackend:
+    """
+    네트워크 없이 결정적인 응답을 돌려주는 가짜 LLM
+    latency: 첫 토큰까지 걸리는 시간(초), tokens: 응답 토큰 수, token_delay: 토큰 사이 간격(초)
+    jitter: latency에 더할 최대 무작위 지연(초, 프롬프트 해시로 고정되므로 재현 가능)
+    """
+
+    def __init__(self, latency=0.2, tokens=200, token_delay=0.0, jitter=0.0):
+        self.latency = latency
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.jitter = jitter
+
+    def _seed(self, prompt):
+        return int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16)
+
+    def _delay(self, prompt):
+        return self.latency + random.Random(self._seed(prompt)).uniform(0, self.jitter)
+
+    def _tokens(self, prompt):
+        seed = self._seed(prompt)
+        return [f"토큰{(seed + i) % 997} " for i in range(self.tokens)]
+
+    def _text(self, prompt, json_mode):
+        text = "".join(self._tokens(prompt)).strip()
+        if not json_mode:
+            return text
+        words = text.split()
+        return json.dumps({"empathy": words[0] if words else "", "risks": words[1:4],
+                           "advice": words[4:7], "questions": words[7:9]}, ensure_ascii=False)
+
+    def _count_usage(self, prompt):
+        # 대략 글자 4개당 토큰 1개로 계산
+        count_tokens(len(prompt) // 4, self.tokens)
+
+    @staticmethod
+    def _sleep_or_timeout(delay, timeout):
+        # 실제 API처럼 제한 시간까지만 기다리고 TimeoutError
+        if timeout and delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"응답 시간 초과 ({timeout}s)")
+        time.sleep(delay)
+
+    def generate(self, prompt, json_mode=False, timeout=None):
+        self._sleep_or_timeout(self._delay(prompt) + self.token_delay * self.tokens, timeout)
+        self._count_usage(prompt)
+        return self._text(prompt, json_mode)
+
+    async def generate_async(self, prompt, json_mode=False, timeout=None):
+        await asyncio.sleep(self._delay(prompt) + self.token_delay * self.tokens)
+        self._count_usage(prompt)
+        return self._text(prompt, json_mode)
+
+    def stream(self, prompt, timeout=None):
+        self._sleep_or_timeout(self._delay(prompt), timeout)
+        for token in self._tokens(prompt):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            yield token
+        self._count_usage(prompt)
+
+    async def stream_async(self, prompt, timeout=None):
+        await asyncio.sleep(self._delay(prompt))
+        for token in self._tokens(prompt):
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield token
+        self._count_usage(prompt)
+
+
+class HttpBackend:
+    """
+    HTTP로 LLM 호출 (가짜 LLM 서버 `python replay.py mock-llm`과 같은 형식)
+    POST {url}/generate {"prompt", "json_mode", "stream"}
+      → {"text", "input_tokens", "output_tokens"}
+      → stream이면 한 줄에 하나씩 {"text": 토큰}, 마지막 줄은 {"input_tokens", "output_tokens"}
+    """
+
+    def __init__(self, url=LLM_HTTP_URL):
+        import httpx
+        self.httpx = httpx
+        self.url = url.rstrip("/") + "/generate"
+        self.client = httpx.Client(timeout=None)
+        self._async_clients = {}  # 이벤트 루프별 클라이언트 (연결 풀은 루프에 묶임)
+
+    def _async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            limits = self.httpx.Limits(max_connections=None, max_keepalive_connections=100)
+            client = self._async_clients[loop] = self.httpx.AsyncClient(timeout=None, limits=limits)
+        return client
+
+    def _check(self, response, body=""):
+        if response.status_code >= 400:
+            raise LLMHTTPError(response.status_code, body[:200])
+
+    def _usage(self, data):
+        count_tokens(data.get("input_tokens"), data.get("output_tokens"))
+
+    def generate(self, prompt, json_mode=False, timeout=None):
+        # httpx의 시간 초과도 재시도/축소 응답 판단에 쓰이도록 TimeoutError로 바꿈
+        try:
+            response = self.client.post(self.url, timeout=timeout,
+                                        json={"prompt": prompt, "json_mode": json_mode, "stream": False})
+        except self.httpx.TimeoutException as e:
+            raise TimeoutError(f"응답 시간 초과: {e}") from e
+        self._check(response, response.text)
+        data = response.json()
+        self._usage(data)
+        return data["text"]
+
+    async def generate_async(self, prompt, json_mode=False, timeout=None):
+        try:
+            response = await self._async_client().post(
+                self.url, timeout=timeout, json={"prompt": prompt, "json_mode": json_mode, "stream": False})
+        except self.httpx.TimeoutException as e:
+            raise TimeoutError(f"응답 시간 초과: {e}") from e
+        self._check(response, response.text)
+        data = response.json()
+        self._usage(data)
+        return data["text"]
+
+    def stream(self, prompt, timeout=None):
+        request = {"prompt": prompt, "json_mode": False, "stream": True}
+        try:
+            with self.client.stream("POST", self.url, json=request, timeout=timeout) as response:
+                if response.status_code >= 400:
+                    self._check(response, response.read().decode("utf-8", "replace"))
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if "text" in data:
+                        yield data["text"]
+                    else:
+                        self._usage(data)
+        except self.httpx.TimeoutException as e:
+            raise TimeoutError(f"응답 시간 초과: {e}") from e
+
+    async def stream_async(self, prompt, timeout=None):
+        request = {"prompt": prompt, "json_mode": False, "stream": True}
+        try:
+            async with self._async_client().stream("POST", self.url, json=request, timeout=timeout) as response:
+                if response.status_code >= 400:
+                    self._check(response, (await response.aread()).decode("utf-8", "replace"))
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if "text" in data:
+                        yield data["text"]
+                    else:
+                        self._usage(data)
+        except self.httpx.TimeoutException as e:
+            raise TimeoutError(f"응답 시간 초과: {e}") from e
+
+
+_END = object()  # 스트림이 토큰 없이 끝났음을 나타냄
+# 동기 스트림의 첫 토큰을 시간 제한을 두고 기다리는 스레드 (모든 호출이 같이 씀)
+_first_token_pool = ThreadPoolExecutor(max_workers=LLM_STREAM_WAITERS, thread_name_prefix="llm-first-token")
+
+
+class RetryingBackend:
+    """
+    백엔드 호출에 시간 제한과 재시도를 붙임
+    일시적 오류(is_transient)만 지수 백오프(+지터)로 retries번까지 다시 시도하고,
+    스트리밍은 첫 토큰이 나오기 전에 실패한 경우에만 다시 시도
+    """
+
+    def __init__(self, backend, timeout=LLM_TIMEOUT, retries=LLM_RETRIES, backoff=LLM_RETRY_BACKOFF):
+        self.backend = backend
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+    def _should_retry(self, error, attempt):
+        if isinstance(error, TimeoutError):
+            RESILIENCE_EVENTS_TOTAL.inc("llm_timeout")
+        if not is_transient(error) or attempt >= self.retries:
+            return False
+        RESILIENCE_EVENTS_TOTAL.inc("llm_retry")
+        print(f"LLM 호출 재시도 ({attempt + 1}/{self.retries}): {type(error).__name__}: {error}")
+        return True
+
+    def _backoff(self, attempt):
+        return self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def generate(self, prompt, json_mode=False, timeout=None):
+        timeout = timeout or self.timeout
+        for attempt in range(self.retries + 1):
+            try:
+                return self.backend.generate(prompt, json_mode, timeout=timeout)
+            except Exception as e:
+                if not self._should_retry(e, attempt):
+                    raise
+            time.sleep(self._backoff(attempt))
+
+    async def generate_async(self, prompt, json_mode=False, timeout=None):
+        timeout = timeout or self.timeout
+        for attempt in range(self.retries + 1):
+            try:
+                return await asyncio.wait_for(self.backend.generate_async(prompt, json_mode, timeout=timeout),
+                                              timeout)
+            except Exception as e:
+                if not self._should_retry(e, attempt):
+                    raise
+            await asyncio.sleep(self._backoff(attempt))
+
+    def stream(self, prompt, timeout=None):
+        timeout = timeout or self.timeout
+        for attempt in range(self.retries + 1):
+            tokens = self.backend.stream(prompt, timeout=timeout)
+            # 첫 토큰까지만 시간 제한 (별도 스레드에서 기다리고, 이후에는 토큰이 오는 대로 전달)
+            waiting = _first_token_pool.submit(next, tokens, _END)
+            started = False
+            try:
+                try:
+                    first = waiting.result(timeout)
+                except FutureTimeout:
+                    waiting.cancel()
+                    raise TimeoutError(f"첫 토큰 응답 시간 초과 ({timeout}s)") from None
+                if first is _END:
+                    return
+                started = True
+                yield first
+                yield from tokens
+                return
+            except Exception as e:
+                if started or not self._should_retry(e, attempt):
+                    raise
+            finally:
+                # 다시 시도하기 전에 스트림(과 밑의 연결)을 닫음
+                # 시간 초과로 next()가 아직 실행 중이면 그 사이에는 닫을 수 없으므로 돌아오는 즉시 닫음
+                waiting.add_done_callback(lambda _, tokens=tokens: tokens.close())
+            time.sleep(self._backoff(attempt))
+
+    async def stream_async(self, prompt, timeout=None):
+        timeout = timeout or self.timeout
+        for attempt in range(self.retries + 1):
+            tokens = self.backend.stream_async(prompt, timeout=timeout)
+            started = False
+            try:
+                # 첫 토큰까지만 시간 제한 (이후에는 토큰이 오는 대로 전달)
+                try:
+                    first = await asyncio.wait_for(tokens.__anext__(), timeout)
+                except StopAsyncIteration:
+                    return
+                started = True
+                yield first
+                async for token in tokens:
+                    yield token
+                return
+            except Exception as e:
+                if started or not self._should_retry(e, attempt):
+                    raise
+            finally:
+                await tokens.aclose()
+            await asyncio.sleep(self._backoff(attempt))
+
+
+def llm_available():
+    """LLM을 쓸 수 있는 상태인지 (스텁은 API 키 없이도 사용 가능)"""
+    return LLM_BACKEND in ("stub", "http") or bool(os.getenv("GOOGLE_API_KEY"))
+
+
+def create_backend(name=None):
+    name = name or LLM_BACKEND
+    if name == "stub":
+        return RetryingBackend(StubBackend(
+            latency=float(os.getenv("STUB_LLM_LATENCY", "0.2")),
+            tokens=int(os.getenv("STUB_LLM_TOKENS", "200")),
+            token_delay=float(os.getenv("STUB_LLM_TOKEN_DELAY", "0")),
+            jitter=float(os.getenv("STUB_LLM_JITTER", "0")),
+        ))
+    if name == "http":
+        return RetryingBackend(HttpBackend())
+    if name == "gemini":
+        return RetryingBackend(GeminiBackend())
+    raise ValueError(f"알 수 없는 LLM 백엔드: {name}")
@@ -0,0 +1,137 @@
+# metrics.py
+# 단계별 소요 시간 / LLM 토큰 수 집계 (Prometheus 텍스트 형식으로 내보내기)
+# 외부 라이브러리 없이 동작하며, 값은 프로세스(워커)별로 따로 집계됨
+import os
+import time
+import uuid
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# 이 시간(초)보다 오래 걸린 요청은 단계별 소요 시간을 통째로 출력
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "5"))
+# 느리지 않은 요청도 이 비율만큼은 무작위로 출력 (0이면 끔)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_name, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_name = label_name
+        self.buckets = buckets
+        self.series = {}  # label 값 -> [버킷별 개수..., 합계, 개수]
+        self._lock = threading.Lock()
+
+    def observe(self, label, value):
+        with self._lock:
+            series = self.series.setdefault(label, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label, series in sorted(self.series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{{{self.label_name}="{label}",le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{self.label_name}="{label}",le="+Inf"}} {series[-1]}')
+                lines.append(f'{self.name}_sum{{{self.label_name}="{label}"}} {series[-2]}')
+                lines.append(f'{self.name}_count{{{self.label_name}="{label}"}} {series[-1]}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label_name):
+        self.name = name
+        self.help_text = help_text
+        self.label_name = label_name
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label, amount=1):
+        with self._lock:
+            self.values[label] = self.values.get(label, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{{{self.label_name}="{label}"}} {value}')
+        return lines
+
+
+STAGE_SECONDS = Histogram("jobnav_stage_seconds", "Time spent per pipeline stage", "stage")
+REQUEST_SECONDS = Histogram("jobnav_request_seconds", "End-to-end request latency", "endpoint")
+REQUESTS_TOTAL = Counter("jobnav_requests_total", "Handled requests", "endpoint")
+LLM_TOKENS_TOTAL = Counter("jobnav_llm_tokens_total", "LLM tokens by direction", "direction")
+RESILIENCE_EVENTS_TOTAL = Counter("jobnav_resilience_events_total",
+                                  "LLM retries/timeouts, coalesced, rejected and degraded requests", "event")
+
+# 현재 요청의 trace (asyncio.to_thread로 넘긴 작업에도 그대로 전달됨)
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+
+@contextmanager
+def stage_timer(stage):
+    """with stage_timer("retrieve"): ... 구간의 소요 시간을 히스토그램과 현재 trace에 기록"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(stage, elapsed)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace["stages"].append((stage, elapsed))
+
+
+def count_tokens(input_tokens, output_tokens):
+    LLM_TOKENS_TOTAL.inc("input", input_tokens or 0)
+    LLM_TOKENS_TOTAL.inc("output", output_tokens or 0)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace["tokens"]["input"] += input_tokens or 0
+        trace["tokens"]["output"] += output_tokens or 0
+
+
+def start_trace(name):
+    """요청 단위 trace 시작 → trace_id 반환"""
+    trace = {"id": uuid.uuid4().hex[:16], "name": name, "start": time.perf_counter(),
+             "stages": [], "tokens": {"input": 0, "output": 0}}
+    _current_trace.set(trace)
+    return trace["id"]
+
+
+def end_trace():
+    """현재 trace를 끝내고 요약 반환. 느린 요청(또는 샘플링된 요청)은 단계별 내역을 출력"""
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    _current_trace.set(None)
+    total = time.perf_counter() - trace["start"]
+    REQUEST_SECONDS.observe(trace["name"], total)
+    REQUESTS_TOTAL.inc(trace["name"])
+    summary = {
+        "trace_id": trace["id"],
+        "total_ms": round(total * 1000, 1),
+        "stages": [{"stage": stage, "ms": round(seconds * 1000, 1)} for stage, seconds in trace["stages"]],
+        "tokens": trace["tokens"],
+    }
+    if total >= SLOW_REQUEST_SECONDS or (TRACE_SAMPLE_RATE and random.random() < TRACE_SAMPLE_RATE):
+        breakdown = ", ".join(f"{s['stage']}={s['ms']}ms" for s in summary["stages"])
+        print(f"[TRACE {trace['id']}] {trace['name']} {summary['total_ms']}ms | {breakdown} | tokens={trace['tokens']}")
+    return summary
+
+
+def render_prometheus():
+    lines = []
+    for metric in (STAGE_SECONDS, REQUEST_SECONDS, REQUESTS_TOTAL, LLM_TOKENS_TOTAL, RESILIENCE_EVENTS_TOTAL):
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
@@ -1,73 +1,395 @@
 import os
-import google.generativeai as genai
-import chromadb
-from chromadb.utils import embedding_functions
+import time
+import uuid
+import asyncio
+import threading
+import numpy as np
 from dotenv import load_dotenv
-import datetime
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from semantic_cache import SemanticCache
+from embedding_cache import EmbeddingCache, normalize_text
+from text_utils import chunk_resume, merge_chunks
+from keyword_index import KeywordIndex, reciprocal_rank_fusion
+from category_router import CategoryRouter, category_filter
+from llm_backends import create_backend, llm_available, is_transient
+from admission import SingleFlight, AdmissionQueue, Overloaded
+from session_store import SessionStore, SESSION_RECENT_TURNS, SESSION_SUMMARY_CHARS, SESSION_TURN_CHARS
+from metrics import stage_timer, RESILIENCE_EVENTS_TOTAL
 
 load_dotenv()
 
-if os.getenv("GOOGLE_API_KEY"):
-    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+# 지식 베이스 저장 위치 (벤치마크 등에서 별도 DB를 쓰기 위해 변경 가능)
+CHROMA_PATH = os.getenv("CHROMA_PATH", "./chroma_db")
+
+# 여러 프로세스(uvicorn --workers N, Streamlit)가 지식 베이스를 같이 쓸 때:
+# CHROMA_HOST를 지정하면 Chroma 서버(`chroma run --path ./chroma_db --port 8001`)에 접속해서
+# 파일은 서버 프로세스 하나만 다룸. 지정하지 않으면 기존처럼 로컬 폴더를 직접 사용 (단일 프로세스용)
+CHROMA_HOST = os.getenv("CHROMA_HOST")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8001"))
+# 1이면 읽기 전용 (시작 시 시드 동기화/팁 추가를 하지 않고, 쓰기 담당 프로세스의 변경만 반영)
+KNOWLEDGE_READ_ONLY = os.getenv("KNOWLEDGE_READ_ONLY", "0") == "1"
+# 다른 프로세스의 변경(버전)을 확인하는 최소 간격(초)
+KNOWLEDGE_POLL_SECONDS = float(os.getenv("KNOWLEDGE_POLL_SECONDS", "2"))
+
+# 기본 코칭 방식: "fast" (평가+상담을 한 번의 호출로) / "two_stage" (팩트 체크 → 상담, 품질 우선)
+PIPELINE_MODE = os.getenv("COACH_PIPELINE_MODE", "fast")
+PIPELINE_MODES = ("fast", "two_stage")
+
+# 동시에 Gemini를 호출할 수 있는 최대 요청 수 (비동기 파이프라인용)
+MAX_CONCURRENCY = int(os.getenv("COACH_MAX_CONCURRENCY", "8"))
+
+# 배치 코칭 시 동시에 돌릴 LLM 작업 수
+BATCH_WORKERS = int(os.getenv("COACH_BATCH_WORKERS", "8"))
+
+# 대량 적재 시 한 번에 임베딩/저장할 문서 수
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "256"))
+
+# 이 글자 수를 넘는 글은 섹션별로 나눠 분석 (map-reduce)
+LONG_DOC_THRESHOLD = int(os.getenv("COACH_LONG_DOC_THRESHOLD", "3000"))
+SECTION_CHARS = int(os.getenv("COACH_SECTION_CHARS", "1500"))
+# 섹션이 이보다 많으면 이웃한 섹션끼리 합침 (글 하나가 LLM 호출을 너무 많이 만들지 않도록)
+MAX_SECTIONS = int(os.getenv("COACH_MAX_SECTIONS", "8"))
+# 상담 단계에 넘기는 섹션 분석 요약/원문 발췌의 최대 길이
+REDUCE_CONTEXT_CHARS = int(os.getenv("COACH_REDUCE_CONTEXT_CHARS", "6000"))
+
+# 하이브리드 검색: 벡터/키워드 후보 수, 프롬프트에 넣을 최대 팁 수
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "8"))
+MAX_TIPS = int(os.getenv("RETRIEVAL_MAX_TIPS", "3"))
+# 팁 개수 자동 조절: RRF 순서대로 보되, 가장 가까운 팁과의 벡터 거리 차이가 이 값 이내이거나
+# BM25 점수가 1등의 이 비율 이상인 팁만 사용 (확실한 1등만 있으면 팁 1개)
+# (RRF 점수는 순위만 반영해서 점수 차이로 확실한 1등인지 알 수 없음)
+TIP_DISTANCE_MARGIN = float(os.getenv("RETRIEVAL_TIP_DISTANCE_MARGIN", "0.15"))
+ADAPTIVE_TIP_RATIO = float(os.getenv("RETRIEVAL_TIP_RATIO", "0.75"))
+
+# 세션(여러 턴) 상담: 이 글자 수 이하의 메시지는 이전 주제의 후속 질문으로 보고 검색 결과를 재사용,
+# 더 긴 메시지는 이전 검색 질문과의 유사도가 이 값 이상일 때만 재사용
+SESSION_FOLLOWUP_CHARS = int(os.getenv("SESSION_FOLLOWUP_CHARS", "300"))
+SESSION_TOPIC_THRESHOLD = float(os.getenv("SESSION_TOPIC_THRESHOLD", "0.75"))
+
+# 응답 캐시 설정 (유사도 기준, 유효 시간(초), 최대 개수, 디스크 저장 여부)
+CACHE_THRESHOLD = float(os.getenv("COACH_CACHE_THRESHOLD", "0.95"))
+CACHE_TTL = int(os.getenv("COACH_CACHE_TTL", "86400"))
+CACHE_SIZE = int(os.getenv("COACH_CACHE_SIZE", "256"))
+CACHE_PATH = "./response_cache.jsonl" if os.getenv("COACH_CACHE_PERSIST", "1") == "1" else None
 
 class CareerAI:
     def __init__(self):
-        if not os.getenv("GOOGLE_API_KEY"):
+        if not llm_available():
             return
         
-        self.model = genai.GenerativeModel('gemini-flash-latest')
-        self.chroma_client = chromadb.PersistentClient(path="./chroma_db")
+        # chromadb(onnxruntime 포함)는 import만으로 느리므로 실제로 쓸 때 불러옴
+        import chromadb
+        from chromadb.utils import embedding_functions
+
+        # LLM 백엔드 (LLM_BACKEND=gemini | stub)
+        self.llm = create_backend()
+        if CHROMA_HOST:
+            self.chroma_client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+        else:
+            self.chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+        self.embedding_fn = embedding_functions.DefaultEmbeddingFunction()
         
         self.collection = self.chroma_client.get_or_create_collection(
             name="career_collection", 
-            embedding_function=embedding_functions.DefaultEmbeddingFunction()
+            embedding_function=self.embedding_fn
         )
+        # 지식 베이스 버전 (쓰기마다 바뀜 → 다른 프로세스가 보고 메모리 인덱스/캐시를 다시 만듦)
+        self.meta_collection = self.chroma_client.get_or_create_collection(
+            name="career_meta",
+            embedding_function=self.embedding_fn
+        )
+        self.knowledge_version = None
+        self._version_checked = 0.0
+        self._refresh_lock = threading.Lock()
+        # BM25 키워드 인덱스 (load_data / add_new_tip 때 컬렉션과 같이 갱신)
+        self.keyword_index = KeywordIndex()
+        # 카테고리 라우터 (LLM 없이 질문 → 카테고리, where 필터로 검색 범위 축소)
+        self.router = CategoryRouter()
+        # 질문 임베딩 재사용 (메모리 LRU + 디스크, 재시작 후에도 유지)
+        self.embedding_cache = EmbeddingCache(
+            model_name=getattr(self.embedding_fn, "MODEL_NAME", type(self.embedding_fn).__name__))
+        # 비슷한 질문에 대한 답변 재사용 (컬렉션과 같은 임베딩 모델 사용)
+        self.cache = SemanticCache(threshold=CACHE_THRESHOLD, ttl=CACHE_TTL,
+                                   max_size=CACHE_SIZE, path=CACHE_PATH)
+        # 비동기 코칭 동시 실행 제한 (이벤트 루프가 하나의 워커에서 여러 요청을 처리)
+        # 넘치는 요청은 대기열 길이만큼만 기다리고 그 이상은 Overloaded(→ 429)로 거절
+        self.admission = AdmissionQueue(MAX_CONCURRENCY)
+        # 긴 글의 섹션별 분석 호출은 요청과 상관없이 이 한도를 같이 씀 (비동기: 세마포어, 동기: 공용 스레드 풀)
+        self.section_slots = asyncio.Semaphore(MAX_CONCURRENCY)
+        self.section_pool = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="section-draft")
+        # 같은 글이 동시에 여러 번 들어오면 LLM은 한 번만 호출
+        self.single_flight = SingleFlight()
+        # 여러 턴 상담 세션 (요약 + 최근 턴), 백그라운드 요약 작업 참조 보관용
+        self.sessions = SessionStore()
+        self._background = set()
+        # 첫 사용자가 모델 로딩 시간을 기다리지 않도록 미리 한 번 실행
+        self.warm_up()
 
-    def load_data(self, data_list):
-        if not os.getenv("GOOGLE_API_KEY"): return
-        if self.collection.count() > 0: return 
-        
-        ids = [str(i) for i in range(len(data_list))]
-        documents = [item['content'] for item in data_list]
-        metadatas = [{"source": item['source'], "category": item['category']} for item in data_list]
+    def warm_up(self):
+        """임베딩 모델(ONNX) 로딩과 Chroma 인덱스 읽기를 미리 끝내 둠"""
+        with stage_timer("warm_up"):
+            embedding = self.embedding_fn(["warm up"])[0]
+            if self.collection.count():
+                self.collection.query(query_embeddings=[[float(x) for x in embedding]], n_results=1)
 
-        self.collection.add(documents=documents, metadatas=metadatas, ids=ids)
-        print("✅ 초기 데이터 로드 완료")
+    @staticmethod
+    def _doc_id(category, source, content, origin):
+        """
+        내용 기반 ID: 같은 팁은 항상 같은 ID, 내용이 바뀌면 ID도 바뀜
+        origin도 포함 (같은 내용이 시드와 관리자 추가, 또는 두 파일에 있어도 서로 지우거나 덮어쓰지 않게)
+        """
+        return hashlib.sha256(f"{origin}\x1f{category}\x1f{source}\x1f{content}".encode("utf-8")).hexdigest()[:32]
+
+    @staticmethod
+    def _is_legacy_seed(doc_id, meta):
+        # 예전 load_data는 "0", "1", ... 순번 ID로 저장했음 (add_new_tip은 14자리 타임스탬프)
+        return "origin" not in (meta or {}) and doc_id.isdigit() and len(doc_id) < 14
+
+    def _read_version(self):
+        found = self.meta_collection.get(ids=["version"], include=["metadatas"])
+        return found['metadatas'][0].get("version") if found['ids'] else None
+
+    def _bump_version(self):
+        """지식 베이스가 바뀌었음을 다른 프로세스에 알림"""
+        version = uuid.uuid4().hex
+        self.meta_collection.upsert(ids=["version"], documents=["version"], metadatas=[{"version": version}],
+                                    embeddings=[[0.0]])
+        self.knowledge_version = version
+
+    def _rebuild_indexes(self):
+        """컬렉션 전체로 키워드 인덱스/라우터를 다시 만듦 → 저장된 문서 반환"""
+        stored = self.collection.get(include=["documents", "metadatas", "embeddings"])
+        stored_embeddings = stored.get('embeddings')
+        if stored_embeddings is None:
+            stored_embeddings = [None] * len(stored['ids'])
+        self.keyword_index.rebuild(stored['ids'], stored['documents'], stored['metadatas'])
+        self.router.rebuild(stored_embeddings, stored['metadatas'])
+        return stored, stored_embeddings
+
+    def refresh_if_stale(self, force=False):
+        """
+        다른 프로세스가 지식을 바꿨으면 (버전이 다르면) 메모리 인덱스를 다시 만들고 답변 캐시를 비움
+        KNOWLEDGE_POLL_SECONDS마다 한 번만 확인 (force=True면 바로 확인)
+        """
+        now = time.monotonic()
+        if not force and now - self._version_checked < KNOWLEDGE_POLL_SECONDS:
+            return False
+        with self._refresh_lock:
+            if not force and now - self._version_checked < KNOWLEDGE_POLL_SECONDS:
+                return False
+            self._version_checked = now
+            try:
+                version = self._read_version()
+                if version == self.knowledge_version:
+                    return False
+                with stage_timer("knowledge_refresh"):
+                    self._rebuild_indexes()
+                self.cache.clear()
+                self.knowledge_version = version
+                print(f"🔄 지식 베이스 변경 반영 (버전 {version})")
+                return True
+            except Exception as e:
+                print(f"지식 베이스 버전 확인 실패: {e}")
+                return False
+
+    def load_data(self, data_list, origin="seed"):
+        """
+        data_list를 컬렉션과 동기화 (같은 origin 안에서만 비교)
+        - 새로 생기거나 바뀐 문서만 배치로 임베딩해서 upsert
+        - data_list에서 사라진 문서는 삭제
+        - 바뀐 게 없으면 임베딩 없이 바로 반환
+        읽기 전용(KNOWLEDGE_READ_ONLY=1)이면 쓰지 않고 현재 컬렉션으로 인덱스만 만듦
+        """
+        if not llm_available(): return
+
+        if KNOWLEDGE_READ_ONLY:
+            self.knowledge_version = self._read_version()
+            self._version_checked = time.monotonic()
+            with stage_timer("ingest_diff"):
+                self._rebuild_indexes()
+            return {"added": 0, "deleted": 0}
+
+        wanted = {}
+        for item in data_list:
+            doc_id = self._doc_id(item['category'], item['source'], item['content'], origin)
+            wanted[doc_id] = item
+
+        # 버전을 먼저 읽어 둬야 이후 다른 프로세스의 변경을 놓치지 않음
+        self.knowledge_version = self._read_version()
+        self._version_checked = time.monotonic()
+        with stage_timer("ingest_diff"):
+            stored, stored_embeddings = self._rebuild_indexes()
+            existing = set()
+            for doc_id, meta in zip(stored['ids'], stored['metadatas']):
+                if (meta or {}).get("origin") == origin or (origin == "seed" and self._is_legacy_seed(doc_id, meta)):
+                    existing.add(doc_id)
+
+        to_add = [doc_id for doc_id in wanted if doc_id not in existing]
+        to_delete = [doc_id for doc_id in existing if doc_id not in wanted]
+        if not to_add and not to_delete:
+            return {"added": 0, "deleted": 0}
+
+        for start in range(0, len(to_add), INGEST_BATCH_SIZE):
+            batch = to_add[start:start + INGEST_BATCH_SIZE]
+            documents = [wanted[doc_id]['content'] for doc_id in batch]
+            metadatas = [{"source": wanted[doc_id]['source'], "category": wanted[doc_id]['category'],
+                          "origin": origin} for doc_id in batch]
+            with stage_timer("ingest_embed"):
+                embeddings = self.embedding_fn(documents)
+            with stage_timer("ingest_upsert"):
+                self.collection.upsert(ids=batch, documents=documents, metadatas=metadatas,
+                                       embeddings=[[float(x) for x in e] for e in embeddings])
+            for doc_id, document, metadata, embedding in zip(batch, documents, metadatas, embeddings):
+                self.keyword_index.add(doc_id, document, metadata)
+                self.router.add(embedding, metadata)
+        if to_delete:
+            with stage_timer("ingest_delete"):
+                self.collection.delete(ids=to_delete)
+            self.keyword_index.remove(to_delete)
+            removed = set(to_delete)
+            for doc_id, meta, embedding in zip(stored['ids'], stored['metadatas'], stored_embeddings):
+                if doc_id in removed:
+                    self.router.remove(embedding, meta)
+
+        self.cache.clear()
+        self._bump_version()
+        print(f"✅ 데이터 동기화 완료 (추가 {len(to_add)}건, 삭제 {len(to_delete)}건)")
+        return {"added": len(to_add), "deleted": len(to_delete)}
 
     def add_new_tip(self, category, source, content):
-        if not os.getenv("GOOGLE_API_KEY"): return False
-        new_id = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+        if not llm_available(): return False
+        if KNOWLEDGE_READ_ONLY:
+            print("읽기 전용 프로세스에서는 지식을 추가할 수 없습니다.")
+            return False
+        new_id = self._doc_id(category, source, content, "admin")
         try:
-            self.collection.add(
-                documents=[content],
-                metadatas=[{"category": category, "source": source}],
-                ids=[new_id]
-            )
+            # 다른 프로세스의 변경을 먼저 반영해야 새 버전을 올린 뒤에도 인덱스가 빠짐없이 유지됨
+            self.refresh_if_stale(force=True)
+            if self.collection.get(ids=[new_id], include=[])['ids']:
+                return True  # 이미 학습된 내용
+            metadata = {"category": category, "source": source, "origin": "admin"}
+            with stage_timer("embed"):
+                embedding = self.embedding_fn([content])[0]
+            with stage_timer("add_tip_upsert"):
+                self.collection.upsert(documents=[content], metadatas=[metadata], ids=[new_id],
+                                       embeddings=[[float(x) for x in embedding]])
+            self.keyword_index.add(new_id, content, metadata)
+            self.router.add(embedding, metadata)
+            # 지식이 바뀌었으니 이전 답변 캐시는 무효 (다른 프로세스는 버전을 보고 반영)
+            self.cache.clear()
+            self._bump_version()
             return True
         except Exception as e:
             print(f"학습 실패: {e}")
             return False
 
-    def get_coaching(self, user_text):
-        if not os.getenv("GOOGLE_API_KEY"):
-            return "API 키가 없습니다.", [], None
+    def _embed_many(self, texts):
+        """질문 임베딩 (캐시에 없는 글만 모델 실행)"""
+        with stage_timer("embed"):
+            return self.embedding_cache.embed(texts, self.embedding_fn)
 
-        # RAG 검색
-        results = self.collection.query(query_texts=[user_text], n_results=2)
-        
+    def _embed(self, user_text):
+        return self._embed_many([user_text])[0]
+
+    def _retrieve(self, user_text, embedding=None):
+        """RAG 검색: 관련 팁 문자열과 출처 목록 반환"""
+        if embedding is None:
+            embedding = self._embed(user_text)
+        return self._retrieve_many([user_text], [embedding])[0]
+
+    def _retrieve_many(self, texts, embeddings):
+        """
+        하이브리드 검색 (벡터 + BM25 키워드, RRF로 합침)
+        벡터 검색은 여러 질문을 한 번의 query로 처리
+        반환: 질문별 (작성 가이드 문자열, 출처 목록)
+        """
+        n_candidates = min(RETRIEVAL_CANDIDATES, len(self.keyword_index)) or RETRIEVAL_CANDIDATES
+
+        # 질문별 카테고리를 정하고, 같은 카테고리 조합끼리 묶어서 한 번씩만 query
+        with stage_timer("route"):
+            routes = [self.router.route(text, embedding) for text, embedding in zip(texts, embeddings)]
+        groups = {}
+        for i, route in enumerate(routes):
+            groups.setdefault(tuple(route or ()), []).append(i)
+
+        hits = [None] * len(texts)
+        for route, indices in groups.items():
+            with stage_timer("chroma_query"):
+                found = self.collection.query(
+                    query_embeddings=[[float(x) for x in embeddings[i]] for i in indices],
+                    n_results=n_candidates, where=category_filter(route),
+                    include=["documents", "metadatas", "distances"]
+                )
+            for pos, i in enumerate(indices):
+                hits[i] = (found['ids'][pos], found['documents'][pos], found['metadatas'][pos],
+                           found['distances'][pos])
+
+        results = []
+        for i, text in enumerate(texts):
+            categories = routes[i]
+            vector_ids, vector_docs, vector_metas, vector_distances = hits[i]
+            if categories and not vector_ids:
+                # 라우팅한 카테고리에 문서가 없으면 전체 검색으로 대체
+                categories = None
+                with stage_timer("chroma_query"):
+                    found = self.collection.query(query_embeddings=[[float(x) for x in embeddings[i]]],
+                                                  n_results=n_candidates,
+                                                  include=["documents", "metadatas", "distances"])
+                vector_ids, vector_docs, vector_metas, vector_distances = (
+                    found['ids'][0], found['documents'][0], found['metadatas'][0], found['distances'][0])
+
+            docs = {}
+            for doc_id, doc, meta in zip(vector_ids, vector_docs, vector_metas):
+                docs[doc_id] = (doc, meta)
+            with stage_timer("keyword_search"):
+                keyword_hits = self.keyword_index.search(text, n_candidates, categories)
+            fused = reciprocal_rank_fusion([vector_ids, [doc_id for doc_id, _ in keyword_hits]])
+            chosen = self._adaptive_tips(fused, dict(zip(vector_ids, vector_distances)), dict(keyword_hits))
+            documents, metadatas = [], []
+            for doc_id in chosen:
+                found = docs.get(doc_id) or self.keyword_index.docs.get(doc_id)
+                if found is None:
+                    continue  # 검색 직후 인덱스가 다시 만들어지면서 빠진 문서
+                doc, meta = found
+                documents.append(doc)
+                metadatas.append(meta)
+            results.append(self._format_tips(documents, metadatas))
+        return results
+
+    @staticmethod
+    def _adaptive_tips(fused, distances, bm25_scores):
+        """
+        RRF 순서대로 최대 MAX_TIPS개 선택 (n_results 자동 조절)
+        1등 팁은 항상 포함, 나머지는 벡터 거리나 BM25 점수가 각 검색의 1등과 가까운 것만
+        """
+        best_distance = min(distances.values()) if distances else None
+        top_bm25 = max(bm25_scores.values()) if bm25_scores else 0.0
+        chosen = []
+        for doc_id, _ in fused:
+            close = ((doc_id in distances and distances[doc_id] <= best_distance + TIP_DISTANCE_MARGIN)
+                     or (top_bm25 > 0 and bm25_scores.get(doc_id, 0.0) >= top_bm25 * ADAPTIVE_TIP_RATIO))
+            if close or not chosen:
+                chosen.append(doc_id)
+            if len(chosen) >= MAX_TIPS:
+                break
+        return chosen
+
+    def _format_tips(self, documents, metadatas):
         found_tips = ""
         sources = []
-        if results['documents'] and results['documents'][0]:
-            for i, doc in enumerate(results['documents'][0]):
-                meta = results['metadatas'][0][i]
-                source_info = f"{meta['category']} - {meta['source']}"
-                found_tips += f"- {source_info}: {doc}\n"
-                sources.append(source_info)
+        for doc, meta in zip(documents or [], metadatas or []):
+            source_info = f"{meta['category']} - {meta['source']}"
+            found_tips += f"- {source_info}: {doc}\n"
+            sources.append(source_info)
+        return found_tips, sources
 
+    def _draft_prompt(self, found_tips, user_text):
         # ------------------------------------------------------------------
         # Step 1: 팩트 체크 (냉정한 현실 인식)
         # ------------------------------------------------------------------
-        draft_prompt = f"""
+        return f"""
         당신은 냉철한 채용 평가관입니다.
         감정을 배제하고 오직 [작성 가이드]와 채용 현실을 기준으로 지원자의 글을 평가하세요.
         "무조건 가능하다"는 판단을 내리지 말고, 부족한 점이나 리스크를 찾아내세요.
@@ -78,17 +400,12 @@ class CareerAI:
         [사용자 자소서 내용]
         {user_text}
         """
-        
-        try:
-            draft_response = self.model.generate_content(draft_prompt)
-            draft_text = draft_response.text
-        except Exception as e:
-            return f"분석 중 에러: {str(e)}", [], None
 
+    def _refine_prompt(self, draft_text, user_text):
         # ------------------------------------------------------------------
         # Step 2: 진정성 있는 상담 (Counseling) - 희망 고문 금지
         # ------------------------------------------------------------------
-        refine_prompt = f"""
+        return f"""
         당신은 의뢰인의 고민을 깊이 들어주는 '진로 상담 전문가'입니다.
         앞선 [분석 내용]을 바탕으로 의뢰인에게 답변을 해주세요.
 
@@ -106,8 +423,696 @@ class CareerAI:
         5. **말투**: "~해요"체를 사용하여 옆에서 차분하게 이야기하듯 작성하세요.
         """
 
+    def _fast_prompt(self, found_tips, user_text, structured=True):
+        # ------------------------------------------------------------------
+        # Fast mode: 평가와 상담을 한 번의 호출로 (structured=True면 JSON 응답)
+        # ------------------------------------------------------------------
+        if structured:
+            output_format = """
+        [출력 형식]
+        아래 키를 가진 JSON 객체 하나만 출력하세요.
+        {"empathy": "공감 한두 문장", "risks": ["우려되는 점", ...], "advice": ["현실적인 대안", ...], "questions": ["되물어볼 질문", ...]}
+        """
+        else:
+            output_format = """
+        [출력 형식]
+        공감 한두 문장 뒤에 "### ⚠️ 우려되는 점", "### 💡 이렇게 바꿔보세요", "### 🙋 생각해볼 질문" 소제목으로 나눠 작성하세요.
+        """
+        return f"""
+        당신은 냉철한 채용 평가관의 눈을 가진 '진로 상담 전문가'입니다.
+        [작성 가이드]와 채용 현실을 기준으로 지원자의 글에서 부족한 점이나 리스크를 찾아내고,
+        그 내용을 바탕으로 의뢰인에게 솔직하지만 따뜻하게 조언하세요.
+
+        [작성 가이드]
+        {found_tips}
+
+        [사용자 자소서 내용]
+        {user_text}
+
+        [상담 가이드 - 중요]
+        1. **무조건적인 긍정 금지**: "합격합니다" 같은 말 대신 "현재 상태에서는 ~한 부분이 우려됩니다"라고 솔직하게 말하세요.
+        2. **공감과 경청**: 글에서 느껴지는 노력이나 고민을 먼저 읽어주세요.
+        3. **현실적 대안 제시**: 채용 담당자가 오해할 수 있는 부분과, 대신 강조할 경험을 구체적으로 제안하세요.
+        4. **질문 유도**: 의뢰인이 스스로 생각할 수 있도록 되물어보세요.
+        5. **말투**: "~해요"체를 사용하세요.
+        {output_format}"""
+
+    def _followup_prompt(self, summary, recent, found_tips, user_text):
+        # ------------------------------------------------------------------
+        # Session: 이어지는 대화 (요약 + 최근 턴만 넣어서 프롬프트 크기를 일정하게)
+        # ------------------------------------------------------------------
+        return f"""
+        당신은 의뢰인과 이어서 대화 중인 '진로 상담 전문가'입니다.
+        [이전 대화 요약]과 [최근 대화]의 맥락을 이어서 의뢰인의 새 메시지에 답하세요.
+        상담사가 앞서 던진 질문에 대한 답이라면, 그 답을 바탕으로 조언을 구체화하세요.
+
+        [이전 대화 요약]
+        {summary or "(없음)"}
+
+        [최근 대화]
+        {recent or "(없음)"}
+
+        [작성 가이드]
+        {found_tips}
+
+        [의뢰인의 새 메시지]
+        {user_text}
+
+        [상담 가이드 - 중요]
+        1. **반복 금지**: 이미 한 조언을 되풀이하지 말고 새 메시지에 필요한 내용만 답하세요.
+        2. **무조건적인 긍정 금지**: 솔직하게 말하고, 필요하면 한 가지만 되물어보세요.
+        3. **말투**: "~해요"체를 사용하세요.
+        """
+
+    def _summary_prompt(self, summary, turns):
+        # ------------------------------------------------------------------
+        # Session: 밀려난 턴을 기존 요약에 합침 (증분 요약)
+        # ------------------------------------------------------------------
+        dialogue = "\n\n".join(f"학생: {user_text[:SESSION_TURN_CHARS]}\n상담사: {answer[:SESSION_TURN_CHARS]}"
+                               for user_text, answer in turns)
+        return f"""
+        아래는 자소서 상담 대화의 [기존 요약]과 그 뒤에 이어진 [대화]입니다.
+        두 내용을 합쳐 {SESSION_SUMMARY_CHARS}자 이내의 요약 하나로 다시 정리하세요.
+        지원 직무, 자소서의 핵심 내용, 지적된 문제점, 의뢰인이 답한 사실(경험/수치)은 반드시 남기세요.
+        요약문만 출력하세요.
+
+        [기존 요약]
+        {summary or "(없음)"}
+
+        [대화]
+        {dialogue}
+        """
+
+    @staticmethod
+    def _parse_fast(text):
+        """fast 모드 JSON 응답 파싱 (형식이 깨지면 전체를 조언 하나로 취급)"""
+        try:
+            data = json.loads(text.strip().removeprefix("```json").removesuffix("```"))
+        except ValueError:
+            return {"empathy": "", "risks": [], "advice": [text], "questions": []}
+        return {key: data.get(key) or ([] if key != "empathy" else "")
+                for key in ("empathy", "risks", "advice", "questions")}
+
+    @staticmethod
+    def _format_fast(data):
+        """구조화된 응답을 채팅용 마크다운으로 변환"""
+        answer = data["empathy"] + "\n\n" if data["empathy"] else ""
+        for title, key in (("### ⚠️ 우려되는 점", "risks"), ("### 💡 이렇게 바꿔보세요", "advice"),
+                           ("### 🙋 생각해볼 질문", "questions")):
+            if data[key]:
+                answer += title + "\n" + "\n".join(f"- {item}" for item in data[key]) + "\n\n"
+        return answer.strip()
+
+    def _retrieve_stage(self, user_text, embedding):
+        """
+        검색 단계: [(분석할 글, 작성 가이드), ...] 와 전체 출처 목록 반환
+        긴 글(embedding=None)은 섹션으로 나누고, 섹션별 검색을 한 번의 query로 처리
+        """
+        if embedding is not None:
+            found_tips, sources = self._retrieve(user_text, embedding)
+            return [(user_text, found_tips)], sources
+
+        sections = merge_chunks(chunk_resume(user_text, max_chars=SECTION_CHARS), MAX_SECTIONS)
+        texts = [section['text'] for section in sections]
+        section_embeddings = self._embed_many(texts)
+        retrieved = self._retrieve_many(texts, section_embeddings)
+        parts, sources = [], []
+        for section, (found_tips, section_sources) in zip(sections, retrieved):
+            parts.append((section['text'], found_tips))
+            sources += [src for src in section_sources if src not in sources]
+        return parts, sources
+
+    def _reduce_drafts(self, parts, drafts):
+        """
+        섹션별 분석 결과를 상담 단계용 하나의 분석 내용으로 합침
+        반환: (분석 내용, 상담 단계에 넘길 원문) - 둘 다 REDUCE_CONTEXT_CHARS 이내
+        """
+        if len(parts) == 1:
+            return drafts[0], parts[0][0]
+        per_section = REDUCE_CONTEXT_CHARS // len(parts)
+        findings = "\n\n".join(f"[섹션 {n}]\n{draft[:per_section]}" for n, draft in enumerate(drafts, 1))
+        # 원문은 섹션마다 앞부분만 발췌해서 전달
+        excerpt = "\n...\n".join(text[:per_section // 2] for text, _ in parts)
+        # 섹션 제목/구분자까지 포함해서 예산을 넘지 않게
+        return findings[:REDUCE_CONTEXT_CHARS], excerpt[:REDUCE_CONTEXT_CHARS]
+
+    def _draft_stage(self, parts):
+        """팩트 체크 단계 (섹션이 여러 개면 공용 스레드 풀에서 병렬 실행) → (분석 내용, 상담 단계에 넘길 원문)"""
+        with stage_timer("llm_draft"):
+            if len(parts) == 1:
+                drafts = [self.llm.generate(self._draft_prompt(parts[0][1], parts[0][0]))]
+            else:
+                drafts = list(self.section_pool.map(
+                    lambda part: self.llm.generate(self._draft_prompt(part[1], part[0])), parts))
+        return self._reduce_drafts(parts, drafts)
+
+    async def _section_draft_async(self, text, found_tips):
+        async with self.section_slots:
+            return await self.llm.generate_async(self._draft_prompt(found_tips, text))
+
+    async def _draft_stage_async(self, parts):
+        with stage_timer("llm_draft"):
+            if len(parts) == 1:
+                drafts = [await self.llm.generate_async(self._draft_prompt(parts[0][1], parts[0][0]))]
+            else:
+                drafts = await asyncio.gather(*[self._section_draft_async(text, found_tips)
+                                                for text, found_tips in parts])
+        return self._reduce_drafts(parts, list(drafts))
+
+    def _cache_embedding(self, user_text):
+        # 캐시를 보기 전에 다른 프로세스의 지식 변경부터 반영
+        self.refresh_if_stale()
+        # 긴 글은 임베딩 모델이 앞부분만 보므로 캐시/단일 검색에 쓰지 않음 (None → 섹션 분석)
+        if len(user_text) > LONG_DOC_THRESHOLD:
+            return None
+        return self._embed(user_text)
+
+    @staticmethod
+    def _resolve_mode(mode, user_text):
+        """실제로 처리할 방식 결정 (긴 글은 항상 섹션별 map-reduce)"""
+        if len(user_text) > LONG_DOC_THRESHOLD:
+            return "map_reduce"
+        mode = mode or PIPELINE_MODE
+        if mode not in PIPELINE_MODES:
+            raise ValueError(f"알 수 없는 코칭 방식: {mode}")
+        return mode
+
+    @staticmethod
+    def _degraded_answer(draft_text):
+        """상담 단계가 시간 초과/쿼터 초과로 실패했을 때 팩트 체크 결과만이라도 돌려줌"""
+        RESILIENCE_EVENTS_TOTAL.inc("degraded")
+        return ("⚠️ 지금은 요청이 많아 상담 답변을 만들지 못했습니다. 팩트 체크 결과를 먼저 보여드리며, "
+                "잠시 후 다시 요청하시면 전체 코칭을 받을 수 있어요.\n\n" + draft_text)
+
+    def _refine_failed(self, error, draft_text, sources):
+        # 일시적 오류면 분석 내용만으로 답변 (캐시에는 저장하지 않음)
+        if is_transient(error):
+            return self._degraded_answer(draft_text), sources, draft_text, True
+        return f"코칭 중 에러: {str(error)}", [], None, False
+
+    def _run_stages(self, parts, sources, mode):
+        """
+        LLM 단계 실행 → (답변, 출처, 분석 내용, 축소 응답 여부)
+        실패하면 (에러 메시지, [], None, False)
+        """
+        if mode == "fast":
+            text, found_tips = parts[0]
+            try:
+                with stage_timer("llm_fast"):
+                    response_text = self.llm.generate(self._fast_prompt(found_tips, text), json_mode=True)
+                data = self._parse_fast(response_text)
+                return self._format_fast(data), sources, data, False
+            except Exception as e:
+                return f"코칭 중 에러: {str(e)}", [], None, False
+
+        try:
+            draft_text, refine_input = self._draft_stage(parts)
+        except Exception as e:
+            return f"분석 중 에러: {str(e)}", [], None, False
+
+        try:
+            with stage_timer("llm_refine"):
+                answer = self.llm.generate(self._refine_prompt(draft_text, refine_input))
+            return answer, sources, draft_text, False
+        except Exception as e:
+            return self._refine_failed(e, draft_text, sources)
+
+    async def _run_stages_async(self, parts, sources, mode):
+        if mode == "fast":
+            text, found_tips = parts[0]
+            try:
+                with stage_timer("llm_fast"):
+                    response_text = await self.llm.generate_async(self._fast_prompt(found_tips, text), json_mode=True)
+                data = self._parse_fast(response_text)
+                return self._format_fast(data), sources, data, False
+            except Exception as e:
+                return f"코칭 중 에러: {str(e)}", [], None, False
+
+        try:
+            draft_text, refine_input = await self._draft_stage_async(parts)
+        except Exception as e:
+            return f"분석 중 에러: {str(e)}", [], None, False
+
+        try:
+            with stage_timer("llm_refine"):
+                answer = await self.llm.generate_async(self._refine_prompt(draft_text, refine_input))
+            return answer, sources, draft_text, False
+        except Exception as e:
+            return self._refine_failed(e, draft_text, sources)
+
+    @staticmethod
+    def _flight_key(user_text, mode):
+        return mode + ":" + hashlib.sha256(normalize_text(user_text).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _with_meta(result, mode, cached=False, coalesced=False):
+        answer, sources, draft, degraded = result
+        return answer, sources, draft, {"mode": mode, "cached": cached, "degraded": degraded,
+                                        "coalesced": coalesced}
+
+    def get_coaching(self, user_text, mode=None, session_id=None):
+        """
+        반환: (답변, 출처, 분석 내용, 메타 정보)
+        메타 정보: {"mode": 처리 방식, "cached": 캐시 사용 여부,
+                    "degraded": 상담 단계 없이 분석 내용만 돌려줬는지, "coalesced": 같은 요청의 결과를 같이 받았는지}
+        session_id를 주면 같은 세션의 이전 대화를 이어서 상담 (두 번째 턴부터 mode "followup")
+        """
+        if not llm_available():
+            return "API 키가 없습니다.", [], None, {"mode": None, "cached": False}
+        if session_id is not None:
+            return self._session_coaching(session_id, user_text, mode)
+
+        mode = self._resolve_mode(mode, user_text)
+        embedding = self._cache_embedding(user_text)
+        cached = self.cache.get(embedding, mode) if embedding is not None else None
+        if cached:
+            return self._with_meta((*cached, False), mode, cached=True)
+
+        def run():
+            parts, sources = self._retrieve_stage(user_text, embedding)
+            result = self._run_stages(parts, sources, mode)
+            if embedding is not None and result[2] is not None and not result[3]:
+                self.cache.put(embedding, result[:3], mode)
+            return result
+
+        result, coalesced = self.single_flight.run(self._flight_key(user_text, mode), run)
+        return self._with_meta(result, mode, coalesced=coalesced)
+
+    async def get_coaching_async(self, user_text, mode=None, session_id=None):
+        """
+        get_coaching의 비동기 버전 (FastAPI 이벤트 루프를 막지 않음)
+        대기열이 가득 차면 Overloaded 예외 (API에서 429로 변환)
+        """
+        if not llm_available():
+            return "API 키가 없습니다.", [], None, {"mode": None, "cached": False}
+        if session_id is not None:
+            return await self._session_coaching_async(session_id, user_text, mode)
+
+        mode = self._resolve_mode(mode, user_text)
+        # 임베딩 계산과 Chroma 검색은 동기 함수라 스레드로 넘김
+        embedding = await asyncio.to_thread(self._cache_embedding, user_text)
+        cached = self.cache.get(embedding, mode) if embedding is not None else None
+        if cached:
+            return self._with_meta((*cached, False), mode, cached=True)
+
+        async def run():
+            async with self.admission.slot():
+                parts, sources = await asyncio.to_thread(self._retrieve_stage, user_text, embedding)
+                result = await self._run_stages_async(parts, sources, mode)
+            if embedding is not None and result[2] is not None and not result[3]:
+                self.cache.put(embedding, result[:3], mode)
+            return result
+
+        result, coalesced = await self.single_flight.run_async(self._flight_key(user_text, mode), run)
+        return self._with_meta(result, mode, coalesced=coalesced)
+
+    def stream_coaching(self, user_text, mode=None, session_id=None):
+        """
+        스트리밍 코칭 (Streamlit용 동기 제너레이터)
+        ("sources", [...]) 를 먼저 내보내고, ("mode", 처리 방식) 다음에
+        최종 답변 토큰을 ("token", 문자열)로 내보냄
+        """
+        if not llm_available():
+            yield "sources", []
+            yield "error", "API 키가 없습니다."
+            return
+        if session_id is not None:
+            yield from self._stream_session_coaching(session_id, user_text, mode)
+            return
+
+        mode = self._resolve_mode(mode, user_text)
+        embedding = self._cache_embedding(user_text)
+        cached = self.cache.get(embedding, mode) if embedding is not None else None
+        if cached:
+            yield "sources", cached[1]
+            yield "mode", mode
+            yield "token", cached[0]
+            return
+
+        parts, sources = self._retrieve_stage(user_text, embedding)
+        yield "sources", sources
+        yield "mode", mode
+
+        if mode == "fast":
+            # 스트리밍에서는 JSON 대신 소제목으로 나눈 마크다운을 한 번의 호출로 받음
+            prompt, draft_text = self._fast_prompt(parts[0][1], parts[0][0], structured=False), None
+        else:
+            try:
+                draft_text, refine_input = self._draft_stage(parts)
+            except Exception as e:
+                yield "error", f"분석 중 에러: {str(e)}"
+                return
+            prompt = self._refine_prompt(draft_text, refine_input)
+
+        answer = ""
+        try:
+            with stage_timer("llm_fast" if mode == "fast" else "llm_refine"):
+                for token in self.llm.stream(prompt):
+                    answer += token
+                    yield "token", token
+            if embedding is not None and mode != "fast":
+                self.cache.put(embedding, (answer, sources, draft_text), mode)
+        except Exception as e:
+            # 상담 단계가 첫 토큰 전에 일시적 오류로 실패하면 분석 내용만 전달
+            if draft_text is not None and not answer and is_transient(e):
+                yield "token", self._degraded_answer(draft_text)
+            else:
+                yield "error", f"코칭 중 에러: {str(e)}"
+
+    async def stream_coaching_async(self, user_text, mode=None, session_id=None):
+        """
+        stream_coaching의 비동기 버전 (SSE 엔드포인트용)
+        대기열이 가득 차면 첫 이벤트 전에 Overloaded 예외
+        """
+        if not llm_available():
+            yield "sources", []
+            yield "error", "API 키가 없습니다."
+            return
+        if session_id is not None:
+            async for event in self._stream_session_coaching_async(session_id, user_text, mode):
+                yield event
+            return
+
+        mode = self._resolve_mode(mode, user_text)
+        embedding = await asyncio.to_thread(self._cache_embedding, user_text)
+        cached = self.cache.get(embedding, mode) if embedding is not None else None
+        if cached:
+            yield "sources", cached[1]
+            yield "mode", mode
+            yield "token", cached[0]
+            return
+
+        async with self.admission.slot():
+            parts, sources = await asyncio.to_thread(self._retrieve_stage, user_text, embedding)
+            yield "sources", sources
+            yield "mode", mode
+
+            if mode == "fast":
+                prompt, draft_text = self._fast_prompt(parts[0][1], parts[0][0], structured=False), None
+            else:
+                try:
+                    draft_text, refine_input = await self._draft_stage_async(parts)
+                except Exception as e:
+                    yield "error", f"분석 중 에러: {str(e)}"
+                    return
+                prompt = self._refine_prompt(draft_text, refine_input)
+
+            answer = ""
+            try:
+                with stage_timer("llm_fast" if mode == "fast" else "llm_refine"):
+                    async for token in self.llm.stream_async(prompt):
+                        answer += token
+                        yield "token", token
+                if embedding is not None and mode != "fast":
+                    self.cache.put(embedding, (answer, sources, draft_text), mode)
+            except Exception as e:
+                if draft_text is not None and not answer and is_transient(e):
+                    yield "token", self._degraded_answer(draft_text)
+                else:
+                    yield "error", f"코칭 중 에러: {str(e)}"
+
+    # ----------------------------------------------------------------------
+    # 세션(여러 턴) 상담
+    # 첫 턴은 일반 코칭(팩트 체크/캐시/긴 글 분석)을 그대로 쓰고, 이후 턴은
+    # 요약 + 최근 턴 + (주제가 같으면 재사용한) 검색 결과로 LLM을 한 번만 호출
+    # ----------------------------------------------------------------------
+    def _starts_topic(self, session, user_text):
+        """일반 코칭으로 처리할 턴인지 (세션의 첫 턴이거나 새 긴 글)"""
+        return session.is_new or len(user_text) > LONG_DOC_THRESHOLD
+
+    @staticmethod
+    def _remember_topic(session, user_text, sources):
+        # 검색 결과는 다음 턴에서 필요할 때 만듦 (첫 턴은 캐시나 섹션 분석으로 처리됐을 수 있음)
+        session.retrieval = {"text": user_text, "embedding": None, "found_tips": None, "sources": sources}
+
+    def _session_retrieval(self, session, user_text):
+        """이전 턴과 주제가 같으면 검색 결과를 재사용 → (작성 가이드, 출처, 재사용 여부)"""
+        previous = session.retrieval
+        embedding = None
+        if previous is not None:
+            if previous["found_tips"] is None:
+                previous["embedding"] = self._embed(previous["text"][:LONG_DOC_THRESHOLD])
+                previous["found_tips"], previous["sources"] = self._retrieve(previous["text"], previous["embedding"])
+            if len(user_text) <= SESSION_FOLLOWUP_CHARS:
+                return previous["found_tips"], previous["sources"], True
+            embedding = self._embed(user_text)
+            a, b = np.asarray(embedding, dtype=np.float32), np.asarray(previous["embedding"], dtype=np.float32)
+            similarity = float(np.dot(a, b) / ((np.linalg.norm(a) * np.linalg.norm(b)) or 1.0))
+            if similarity >= SESSION_TOPIC_THRESHOLD:
+                return previous["found_tips"], previous["sources"], True
+        if embedding is None:
+            embedding = self._embed(user_text)
+        found_tips, sources = self._retrieve(user_text, embedding)
+        session.retrieval = {"text": user_text, "embedding": embedding, "found_tips": found_tips, "sources": sources}
+        return found_tips, sources, False
+
+    def _followup_input(self, session, user_text):
+        """이어지는 턴의 준비 (버전 확인 + 검색) → (프롬프트, 출처, 검색 재사용 여부)"""
+        self.refresh_if_stale()
+        found_tips, sources, reused = self._session_retrieval(session, user_text)
+        summary, recent = session.context()
+        return self._followup_prompt(summary, recent, found_tips, user_text), sources, reused
+
+    def _fold_session(self, session):
+        """최근 턴 밖으로 밀려난 대화를 요약에 합침 (답변을 돌려준 뒤 백그라운드에서 실행)"""
+        folded = session.turns_to_fold()
+        if not folded:
+            return
+        summary = None
         try:
-            final_response = self.model.generate_content(refine_prompt)
-            return final_response.text, sources, draft_text 
+            with stage_timer("llm_summary"):
+                summary = self.llm.generate(self._summary_prompt(session.summary, folded)).strip()
         except Exception as e:
-            return f"코칭 중 에러: {str(e)}", [], None
\ No newline at end of file
+            print(f"대화 요약 실패: {e}")
+        finally:
+            session.fold(summary, folded)
+
+    async def _fold_session_async(self, session):
+        folded = session.turns_to_fold()
+        if not folded:
+            return
+        summary = None
+        try:
+            with stage_timer("llm_summary"):
+                summary = (await self.llm.generate_async(self._summary_prompt(session.summary, folded))).strip()
+        except Exception as e:
+            print(f"대화 요약 실패: {e}")
+        finally:
+            session.fold(summary, folded)
+
+    def _finish_turn(self, session, user_text, answer):
+        session.add_turn(user_text, answer)
+        if len(session.turns) <= SESSION_RECENT_TURNS:
+            return
+        # 요약은 다음 턴 응답 시간에 영향이 없도록 백그라운드에서
+        try:
+            task = asyncio.get_running_loop().create_task(self._fold_session_async(session))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+        except RuntimeError:
+            threading.Thread(target=self._fold_session, args=(session,), daemon=True).start()
+
+    @staticmethod
+    def _followup_meta(reused):
+        return {"mode": "followup", "cached": False, "degraded": False, "coalesced": False,
+                "retrieval_reused": reused}
+
+    def _session_coaching(self, session_id, user_text, mode):
+        session = self.sessions.get(session_id)
+        if self._starts_topic(session, user_text):
+            answer, sources, draft, meta = self.get_coaching(user_text, mode)
+            if draft is not None:
+                self._remember_topic(session, user_text, sources)
+                self._finish_turn(session, user_text, answer)
+            return answer, sources, draft, meta
+
+        prompt, sources, reused = self._followup_input(session, user_text)
+        try:
+            with stage_timer("llm_followup"):
+                answer = self.llm.generate(prompt)
+        except Exception as e:
+            return f"코칭 중 에러: {str(e)}", [], None, self._followup_meta(reused)
+        self._finish_turn(session, user_text, answer)
+        return answer, sources, "", self._followup_meta(reused)
+
+    async def _session_coaching_async(self, session_id, user_text, mode):
+        session = self.sessions.get(session_id)
+        if self._starts_topic(session, user_text):
+            answer, sources, draft, meta = await self.get_coaching_async(user_text, mode)
+            if draft is not None:
+                self._remember_topic(session, user_text, sources)
+                self._finish_turn(session, user_text, answer)
+            return answer, sources, draft, meta
+
+        async with self.admission.slot():
+            prompt, sources, reused = await asyncio.to_thread(self._followup_input, session, user_text)
+            try:
+                with stage_timer("llm_followup"):
+                    answer = await self.llm.generate_async(prompt)
+            except Exception as e:
+                return f"코칭 중 에러: {str(e)}", [], None, self._followup_meta(reused)
+        self._finish_turn(session, user_text, answer)
+        return answer, sources, "", self._followup_meta(reused)
+
+    def _stream_session_coaching(self, session_id, user_text, mode):
+        session = self.sessions.get(session_id)
+        if self._starts_topic(session, user_text):
+            answer, sources, failed = "", [], False
+            for kind, payload in self.stream_coaching(user_text, mode):
+                if kind == "sources":
+                    sources = payload
+                elif kind == "token":
+                    answer += payload
+                elif kind == "error":
+                    failed = True
+                yield kind, payload
+            if answer and not failed:
+                self._remember_topic(session, user_text, sources)
+                self._finish_turn(session, user_text, answer)
+            return
+
+        prompt, sources, _ = self._followup_input(session, user_text)
+        yield "sources", sources
+        yield "mode", "followup"
+        answer = ""
+        try:
+            with stage_timer("llm_followup"):
+                for token in self.llm.stream(prompt):
+                    answer += token
+                    yield "token", token
+        except Exception as e:
+            yield "error", f"코칭 중 에러: {str(e)}"
+            return
+        self._finish_turn(session, user_text, answer)
+
+    async def _stream_session_coaching_async(self, session_id, user_text, mode):
+        session = self.sessions.get(session_id)
+        if self._starts_topic(session, user_text):
+            answer, sources, failed = "", [], False
+            async for kind, payload in self.stream_coaching_async(user_text, mode):
+                if kind == "sources":
+                    sources = payload
+                elif kind == "token":
+                    answer += payload
+                elif kind == "error":
+                    failed = True
+                yield kind, payload
+            if answer and not failed:
+                self._remember_topic(session, user_text, sources)
+                self._finish_turn(session, user_text, answer)
+            return
+
+        async with self.admission.slot():
+            prompt, sources, _ = await asyncio.to_thread(self._followup_input, session, user_text)
+            yield "sources", sources
+            yield "mode", "followup"
+            answer = ""
+            try:
+                with stage_timer("llm_followup"):
+                    async for token in self.llm.stream_async(prompt):
+                        answer += token
+                        yield "token", token
+            except Exception as e:
+                yield "error", f"코칭 중 에러: {str(e)}"
+                return
+        self._finish_turn(session, user_text, answer)
+
+    def _prepare_batch(self, texts, mode):
+        """
+        배치의 임베딩/캐시 확인/검색을 한 번에 처리
+        반환: (처리 방식 목록, 결과 목록(캐시에 있던 항목만 채움), 임베딩, 검색 결과, LLM 단계가 남은 인덱스)
+        """
+        self.refresh_if_stale()
+        modes = [self._resolve_mode(mode, text) for text in texts]
+        results = [None] * len(texts)
+        # 긴 글은 섹션 분석 경로로 따로 처리
+        long_docs = [i for i, text in enumerate(texts) if len(text) > LONG_DOC_THRESHOLD]
+        short_docs = [i for i, text in enumerate(texts) if len(text) <= LONG_DOC_THRESHOLD]
+        embeddings = dict(zip(short_docs, self._embed_many([texts[i] for i in short_docs]))) if short_docs else {}
+
+        # 캐시에 있는 항목은 바로 채우고, 나머지만 검색
+        pending = []
+        for i, embedding in embeddings.items():
+            cached = self.cache.get(embedding, modes[i])
+            if cached:
+                results[i] = {"answer": cached[0], "sources": cached[1], "draft": cached[2],
+                              "mode": modes[i], "error": None}
+            else:
+                pending.append(i)
+
+        retrieved = {}
+        if pending:
+            for i, found in zip(pending, self._retrieve_many([texts[i] for i in pending],
+                                                             [embeddings[i] for i in pending])):
+                found_tips, sources = found
+                retrieved[i] = ([(texts[i], found_tips)], sources)
+        return modes, results, embeddings, retrieved, pending + long_docs
+
+    def _batch_result(self, i, mode, embeddings, result):
+        answer, sources, draft, degraded = result
+        if draft is None:
+            return {"answer": None, "sources": [], "draft": None, "mode": mode, "error": answer}
+        if i in embeddings and not degraded:
+            self.cache.put(embeddings[i], (answer, sources, draft), mode)
+        return {"answer": answer, "sources": sources, "draft": draft, "mode": mode, "error": None}
+
+    def get_coaching_batch(self, texts, mode=None):
+        """
+        여러 자소서를 한 번에 코칭 (history 재분석 등)
+        임베딩/검색은 한 번의 query로 처리하고, LLM 단계는 스레드 풀에서 병렬 실행
+        반환: 입력 순서대로 {"answer", "sources", "draft", "mode", "error"} 딕셔너리 리스트
+        """
+        if not llm_available():
+            return [{"answer": None, "sources": [], "draft": None, "mode": None, "error": "API 키가 없습니다."}
+                    for _ in texts]
+        if not texts:
+            return []
+
+        modes, results, embeddings, retrieved, todo = self._prepare_batch(texts, mode)
+
+        def run(i):
+            if i in retrieved:
+                parts, sources = retrieved[i]
+            else:
+                parts, sources = self._retrieve_stage(texts[i], None)
+            return self._batch_result(i, modes[i], embeddings, self._run_stages(parts, sources, modes[i]))
+
+        with ThreadPoolExecutor(max_workers=BATCH_WORKERS) as pool:
+            for i, result in zip(todo, pool.map(run, todo)):
+                results[i] = result
+
+        return results
+
+    async def get_coaching_batch_async(self, texts, mode=None):
+        """
+        get_coaching_batch의 비동기 버전 (API용)
+        LLM 단계는 항목마다 대기열 자리를 받아서 실행 (다른 코칭 요청과 같은 동시 실행 한도를 씀)
+        한 배치에서 동시에 대기열에 들어가는 항목은 BATCH_WORKERS개까지 → 뒤쪽 항목이 앞 항목을 기다리느라
+        ADMISSION_MAX_WAIT_SECONDS를 넘기지 않고, 대기 시간은 다른 요청과 자리를 다툴 때만 적용됨
+        대기열에 그만큼 들어갈 자리가 없으면 Overloaded (API에서 429로 변환)
+        """
+        if not llm_available():
+            return self.get_coaching_batch(texts, mode)
+        if not texts:
+            return []
+
+        modes, results, embeddings, retrieved, todo = await asyncio.to_thread(self._prepare_batch, texts, mode)
+        workers = min(BATCH_WORKERS, self.admission.max_active, len(todo))
+        self.admission.check(workers)
+        batch_slots = asyncio.Semaphore(workers)
+
+        async def run(i):
+            try:
+                async with batch_slots, self.admission.slot():
+                    if i in retrieved:
+                        parts, sources = retrieved[i]
+                    else:
+                        parts, sources = await asyncio.to_thread(self._retrieve_stage, texts[i], None)
+                    result = await self._run_stages_async(parts, sources, modes[i])
+            except Overloaded as e:
+                return {"answer": None, "sources": [], "draft": None, "mode": modes[i], "error": str(e)}
+            return self._batch_result(i, modes[i], embeddings, result)
+
+        for i, result in zip(todo, await asyncio.gather(*[run(i) for i in todo])):
+            results[i] = result
+        return results
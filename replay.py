@@ -0,0 +1,467 @@
+# replay.py
+# 실제 트래픽 기록 → 재생 부하 테스트 (워커 수 산정, 이벤트 루프 블로킹 회귀 확인용)
+#
+# 사용법:
+#   1) 기록: RECORD_REQUESTS_PATH=replay_requests.jsonl uvicorn api:app  → 코칭 요청이 익명화되어 쌓임
+#      (또는 기존 대화 기록으로 만들기: python replay.py from-history --out replay_requests.jsonl)
+#   2) 가짜 LLM 서버: python replay.py mock-llm --port 9100 --latency 0.8 --jitter 0.4 --error-rate 0.02
+#   3) API 서버를 가짜 LLM에 연결:
+#      LLM_BACKEND=http LLM_HTTP_URL=http://127.0.0.1:9100 uvicorn api:app --workers 2 --port 8000
+#   4) 재생: python replay.py run --url http://127.0.0.1:8000 --rps 2,5,10,20 --duration 30
+#            python replay.py run --url http://127.0.0.1:8000 --concurrency 1,8,32,64 --duration 30 --json out.json
+# (run과 LLM_BACKEND=http에는 httpx 필요: pip install httpx)
+import os
+import re
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import sqlite3
+import hashlib
+import asyncio
+import argparse
+import threading
+import datetime
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 설정하면 API 서버가 받은 코칭 요청을 이 파일에 익명화해서 기록
+RECORD_REQUESTS_PATH = os.getenv("RECORD_REQUESTS_PATH")
+DEFAULT_REPLAY_FILE = "replay_requests.jsonl"
+
+# 개인정보로 볼 수 있는 부분은 자리표시자로 바꿈 (길이와 문장 구조는 유지)
+PII_PATTERNS = [
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "<EMAIL>"),
+    (re.compile(r"https?://\S+"), "<URL>"),
+    (re.compile(r"\d{6}\s*-\s*[1-4]\d{6}"), "<RRN>"),
+    (re.compile(r"(?:\+82[-\s]?)?0\d{1,2}[-\s.]?\d{3,4}[-\s.]?\d{4}"), "<PHONE>"),
+    (re.compile(r"(이름|성명)\s*[:：]\s*\S+"), r"\1: <NAME>"),
+    (re.compile(r"\d{6,}"), "<NUM>"),
+]
+
+
+def anonymize(text):
+    for pattern, replacement in PII_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def pseudonym(value):
+    """세션/클라이언트 구분은 유지하되 원래 값은 알 수 없게"""
+    return hashlib.sha256(f"replay:{value}".encode("utf-8")).hexdigest()[:12] if value else None
+
+
+class TrafficRecorder:
+    """
+    코칭 요청을 JSONL로 한 줄씩 기록 (path가 없으면 아무것도 안 함)
+    파일 쓰기는 백그라운드 스레드가 모아서 하므로 record()는 이벤트 루프를 막지 않음
+    """
+
+    def __init__(self, path=RECORD_REQUESTS_PATH):
+        self.path = path
+        self._queue = queue.Queue()
+        self._writer = None
+        self._lock = threading.Lock()
+        if path:
+            atexit.register(self.flush)  # 종료 전에 남은 기록을 씀
+
+    def record(self, endpoint, user_input, mode=None, session_id=None, client=None):
+        if not self.path:
+            return
+        self._start_writer()
+        self._queue.put({
+            "ts": datetime.datetime.now().isoformat(timespec="seconds"),
+            "endpoint": endpoint,
+            "user_input": user_input,
+            "mode": mode,
+            "session": session_id,
+            "client": client,
+        })
+
+    def _start_writer(self):
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._writer_loop, name="traffic-recorder", daemon=True)
+                self._writer.start()
+
+    def flush(self):
+        """대기 중인 기록을 모두 쓸 때까지 기다림"""
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.join()
+
+    def _writer_loop(self):
+        while True:
+            items = [self._queue.get()]
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            # 익명화(정규식)도 요청 경로가 아니라 여기서
+            lines = [json.dumps({**item, "user_input": anonymize(item["user_input"]),
+                                 "session": pseudonym(item["session"]), "client": pseudonym(item["client"])},
+                                ensure_ascii=False) + "\n" for item in items]
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.writelines(lines)
+            except OSError as e:
+                print(f"요청 기록 실패: {e}")
+            for _ in items:
+                self._queue.task_done()
+
+
+# =========================================================================
+# 가짜 LLM 서버 (llm_backends.HttpBackend 형식)
+# =========================================================================
+def make_mock_handler(args):
+    from llm_backends import StubBackend
+    # 응답 내용은 스텁과 같음 (지연/오류는 이 서버에서 직접 흉내냄)
+    stub = StubBackend(latency=0, tokens=args.tokens)
+    rng = random.Random(args.seed)
+    rng_lock = threading.Lock()
+
+    class MockLLMHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass  # 요청마다 출력하지 않음
+
+        def _send(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _chunk(self, body):
+            data = (json.dumps(body, ensure_ascii=False) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            prompt = request.get("prompt", "")
+            with rng_lock:
+                failed = rng.random() < args.error_rate
+                delay = args.latency + rng.uniform(0, args.jitter)
+            time.sleep(delay)
+            if failed:
+                self._send(args.error_status, {"error": "mock failure"})
+                return
+            usage = {"input_tokens": len(prompt) // 4, "output_tokens": args.tokens}
+            if not request.get("stream"):
+                time.sleep(args.token_delay * args.tokens)
+                self._send(200, {"text": stub._text(prompt, request.get("json_mode")), **usage})
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for token in stub._tokens(prompt):
+                if args.token_delay:
+                    time.sleep(args.token_delay)
+                self._chunk({"text": token})
+            self._chunk(usage)
+            self.wfile.write(b"0\r\n\r\n")
+
+    return MockLLMHandler
+
+
+def serve_mock_llm(args):
+    server = ThreadingHTTPServer((args.host, args.port), make_mock_handler(args))
+    server.daemon_threads = True
+    print(f"가짜 LLM 서버: http://{args.host}:{args.port} (지연 {args.latency}+{args.jitter}s, "
+          f"토큰 {args.tokens}개, 오류율 {args.error_rate:.1%} → {args.error_status})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+# =========================================================================
+# 기존 대화 기록 → 재생 파일
+# =========================================================================
+def export_history(args):
+    conn = sqlite3.connect(args.db)
+    rows = conn.execute("SELECT timestamp, user_input FROM history ORDER BY id DESC LIMIT ?", (args.limit,))
+    count = 0
+    with open(args.out, "w", encoding="utf-8") as f:
+        for timestamp, user_input in reversed(rows.fetchall()):
+            if not user_input:
+                continue
+            f.write(json.dumps({"ts": timestamp, "endpoint": "/api/coach", "user_input": anonymize(user_input),
+                                "mode": None, "session": None, "client": None}, ensure_ascii=False) + "\n")
+            count += 1
+    conn.close()
+    print(f"{args.out}: {count}건 저장")
+
+
+# =========================================================================
+# 재생
+# =========================================================================
+LLM_ERROR_PREFIXES = ("코칭 중 에러", "분석 중 에러")
+
+
+class StepStats:
+    def __init__(self):
+        self.latencies = []
+        self.first_token = []
+        self.errors = Counter()
+        self.degraded = 0
+        self.sent = 0
+        self.healthz = []
+
+
+def load_records(path):
+    if not os.path.exists(path):
+        sys.exit(f"{path}가 없습니다. RECORD_REQUESTS_PATH로 기록하거나 from-history로 만들어주세요.")
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records = [r for r in records if r.get("user_input")]
+    if not records:
+        sys.exit(f"{path}에 재생할 요청이 없습니다.")
+    return records
+
+
+async def send(client, record, i, args, stats):
+    endpoint = args.endpoint or record.get("endpoint") or "/api/coach"
+    payload = {"user_input": record["user_input"]}
+    if args.bust_cache:
+        payload["user_input"] += f" (재생 {i})"
+    if record.get("mode"):
+        payload["mode"] = record["mode"]
+    if record.get("session"):
+        payload["session_id"] = record["session"]
+    # 서버는 등록된 API 키별로 속도 제한 → 기록된 클라이언트마다 같은 키를 쓰도록 나눠 보냄
+    headers = {}
+    if args.api_keys:
+        client_key = record.get("client") or str(i % args.clients)
+        headers["X-Api-Key"] = args.api_keys[int(hashlib.sha256(client_key.encode()).hexdigest(), 16)
+                                             % len(args.api_keys)]
+
+    stats.sent += 1
+    start = time.perf_counter()
+    try:
+        if endpoint.endswith("/stream"):
+            async with client.stream("POST", endpoint, json=payload, headers=headers) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    stats.errors[f"HTTP {response.status_code}"] += 1
+                    return
+                failed, first = False, None
+                async for line in response.aiter_lines():
+                    if line.startswith("event: token") and first is None:
+                        first = time.perf_counter() - start
+                    elif line.startswith("event: error"):
+                        failed = True
+            if failed:
+                stats.errors["llm_error"] += 1
+                return
+            if first is not None:
+                stats.first_token.append(first)
+        else:
+            response = await client.post(endpoint, json=payload, headers=headers)
+            if response.status_code != 200:
+                stats.errors[f"HTTP {response.status_code}"] += 1
+                return
+            data = response.json()
+            # LLM 오류는 200 + 에러 메시지로 돌아옴
+            if str(data.get("answer", "")).startswith(LLM_ERROR_PREFIXES):
+                stats.errors["llm_error"] += 1
+                return
+            if data.get("degraded"):
+                stats.degraded += 1
+        stats.latencies.append(time.perf_counter() - start)
+    except Exception as e:
+        stats.errors[type(e).__name__] += 1
+
+
+async def probe_healthz(client, stats, stop):
+    """부하 중 /healthz 응답 시간 (이벤트 루프가 막히면 여기서 바로 드러남)"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            await client.get("/healthz")
+            stats.healthz.append(time.perf_counter() - start)
+        except Exception:
+            stats.errors["healthz"] += 1
+        await asyncio.sleep(0.1)
+
+
+async def run_step(args, records, rps=None, concurrency=None):
+    import httpx
+    stats = StepStats()
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=timeout) as client, \
+            httpx.AsyncClient(base_url=args.url, timeout=timeout) as probe_client:
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_healthz(probe_client, stats, stop))
+        start = time.perf_counter()
+        deadline = start + args.duration
+        counter = iter(range(sys.maxsize))
+
+        if rps is not None:
+            # 열린 루프: 응답을 기다리지 않고 정해진 간격으로 보냄 (서버가 밀리면 지연 시간에 그대로 반영)
+            tasks, next_at = [], start
+            for i in counter:
+                if next_at >= deadline:
+                    break
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(send(client, records[i % len(records)], i, args, stats)))
+                next_at += random.expovariate(rps) if args.poisson else 1 / rps
+            await asyncio.gather(*tasks)
+        else:
+            # 닫힌 루프: concurrency개의 사용자가 응답을 받자마자 다음 요청
+            async def user():
+                for i in counter:
+                    if time.perf_counter() >= deadline:
+                        break
+                    await send(client, records[i % len(records)], i, args, stats)
+            await asyncio.gather(*[user() for _ in range(concurrency)])
+
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await probe
+    return stats, elapsed
+
+
+def step_row(stats, elapsed, rps, concurrency):
+    from benchmark import summarize, percentile
+    failed = sum(count for kind, count in stats.errors.items() if kind != "healthz")
+    return {
+        "target_rps": rps,
+        "concurrency": concurrency,
+        "sent": stats.sent,
+        "ok": len(stats.latencies),
+        "throughput_rps": len(stats.latencies) / elapsed if elapsed else 0.0,
+        **summarize(stats.latencies),
+        "first_token_p95_ms": percentile(stats.first_token, 95) * 1000 if stats.first_token else None,
+        "error_rate": failed / stats.sent if stats.sent else 0.0,
+        "errors": dict(stats.errors),
+        "degraded": stats.degraded,
+        "healthz_p99_ms": percentile(stats.healthz, 99) * 1000,
+    }
+
+
+def find_saturation(rows, args):
+    """처음으로 목표를 못 맞춘 단계 (목표 처리량 미달, 오류율 초과, p99 SLO 초과, 동시성 증가 대비 처리량 정체)"""
+    previous = None
+    for row in rows:
+        reasons = []
+        if row["target_rps"] and row["throughput_rps"] < 0.9 * row["target_rps"]:
+            reasons.append(f"처리량 {row['throughput_rps']:.1f}/{row['target_rps']} rps")
+        if row["error_rate"] > args.max_error_rate:
+            reasons.append(f"오류율 {row['error_rate']:.1%}")
+        if args.slo_p99_ms and row["p99_ms"] > args.slo_p99_ms:
+            reasons.append(f"p99 {row['p99_ms']:.0f}ms > {args.slo_p99_ms:.0f}ms")
+        if row["concurrency"] and previous and row["throughput_rps"] < 1.1 * previous["throughput_rps"]:
+            reasons.append(f"동시성 {previous['concurrency']}→{row['concurrency']}에도 처리량 정체")
+        if reasons:
+            return row, previous, reasons
+        previous = row
+    return None, previous, []
+
+
+def report(rows, args):
+    header = f"{'rps':>6}{'conc':>6}{'sent':>7}{'ok':>7}{'tput':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'err%':>7}{'hz p99':>9}  errors"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        errors = ", ".join(f"{kind}={count}" for kind, count in sorted(row["errors"].items())) or "-"
+        print(f"{row['target_rps'] or '-':>6}{row['concurrency'] or '-':>6}{row['sent']:>7}{row['ok']:>7}"
+              f"{row['throughput_rps']:>8.1f}{row['p50_ms']:>9.0f}{row['p95_ms']:>9.0f}{row['p99_ms']:>9.0f}"
+              f"{row['error_rate'] * 100:>7.1f}{row['healthz_p99_ms']:>9.1f}  {errors}")
+
+    saturated, last_ok, reasons = find_saturation(rows, args)
+    if saturated is None:
+        print("\n포화 지점 없음 (더 높은 부하로 다시 측정해보세요)")
+    else:
+        step = f"rps={saturated['target_rps']}" if saturated["target_rps"] else f"동시성={saturated['concurrency']}"
+        print(f"\n포화 지점: {step} ({'; '.join(reasons)})")
+        if last_ok:
+            print(f"안정적으로 처리한 최대 부하: {last_ok['throughput_rps']:.1f} rps "
+                  f"(p99 {last_ok['p99_ms']:.0f}ms)")
+    # /healthz가 느려지면 요청 처리 중 이벤트 루프를 막는 코드가 있다는 뜻
+    slow_probe = [row for row in rows if row["healthz_p99_ms"] > args.healthz_p99_ms]
+    if slow_probe:
+        print(f"⚠️ /healthz p99가 {args.healthz_p99_ms:.0f}ms를 넘은 단계가 있습니다 (이벤트 루프 블로킹 의심)")
+
+
+def run_replay(args):
+    records = load_records(args.file)
+    args.api_keys = [k.strip() for k in (args.api_keys or "").split(",") if k.strip()]
+    steps = ([(float(r), None) for r in args.rps.split(",")] if args.rps
+             else [(None, int(c)) for c in args.concurrency.split(",")])
+    rows = []
+    for rps, concurrency in steps:
+        label = f"{rps} rps" if rps else f"동시성 {concurrency}"
+        print(f"▶ {label} ({args.duration}s)...")
+        stats, elapsed = asyncio.run(run_step(args, records, rps, concurrency))
+        rows.append(step_row(stats, elapsed, rps, concurrency))
+        if args.cooldown:
+            time.sleep(args.cooldown)
+    print()
+    report(rows, args)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Job-Navigator 트래픽 재생 부하 테스트")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="기록된 요청을 실행 중인 API 서버로 재생")
+    run.add_argument("--url", default="http://127.0.0.1:8000")
+    run.add_argument("--file", default=DEFAULT_REPLAY_FILE)
+    load = run.add_mutually_exclusive_group()
+    load.add_argument("--rps", help="목표 초당 요청 수 단계 (예: 2,5,10,20)")
+    load.add_argument("--concurrency", default="1,8,32", help="동시 사용자 수 단계 (예: 1,8,32,64)")
+    run.add_argument("--duration", type=float, default=30, help="단계별 측정 시간(초)")
+    run.add_argument("--cooldown", type=float, default=2, help="단계 사이 대기 시간(초)")
+    run.add_argument("--endpoint", help="기록과 상관없이 이 엔드포인트로 보냄 (예: /api/coach/stream)")
+    run.add_argument("--poisson", action="store_true", help="--rps 간격을 포아송 분포로 (실제 트래픽처럼 몰림 발생)")
+    run.add_argument("--bust-cache", action="store_true", help="요청마다 글을 조금씩 바꿔 응답 캐시를 피함")
+    run.add_argument("--api-keys", help="서버의 RATE_LIMIT_API_KEYS에 등록한 키 (쉼표 구분, 클라이언트별로 나눠 씀)."
+                                        " 없으면 모든 요청이 한 IP라 서버에서 RATE_LIMIT_PER_MINUTE=0으로 꺼야 함")
+    run.add_argument("--clients", type=int, default=50, help="기록에 클라이언트가 없을 때 나눠 쓸 가상 클라이언트 수")
+    run.add_argument("--timeout", type=float, default=120)
+    run.add_argument("--max-connections", type=int, default=1000)
+    run.add_argument("--max-error-rate", type=float, default=0.01)
+    run.add_argument("--slo-p99-ms", type=float, help="이 p99를 넘으면 포화로 판단")
+    run.add_argument("--healthz-p99-ms", type=float, default=100, help="이 값을 넘으면 이벤트 루프 블로킹 경고")
+    run.add_argument("--json", help="결과를 저장할 JSON 파일 경로")
+
+    mock = commands.add_parser("mock-llm", help="지연/오류율을 조절할 수 있는 가짜 LLM HTTP 서버")
+    mock.add_argument("--host", default="127.0.0.1")
+    mock.add_argument("--port", type=int, default=9100)
+    mock.add_argument("--latency", type=float, default=0.8, help="첫 토큰까지 기본 지연(초)")
+    mock.add_argument("--jitter", type=float, default=0.4, help="지연에 더할 최대 무작위 시간(초)")
+    mock.add_argument("--tokens", type=int, default=200)
+    mock.add_argument("--token-delay", type=float, default=0.0, help="토큰 사이 간격(초)")
+    mock.add_argument("--error-rate", type=float, default=0.0)
+    mock.add_argument("--error-status", type=int, default=503, help="오류 응답 상태 코드 (429면 쿼터 초과 흉내)")
+    mock.add_argument("--seed", type=int, default=None)
+
+    history = commands.add_parser("from-history", help="대화 기록 DB로 재생 파일 만들기 (익명화)")
+    history.add_argument("--db", default="monitor/user_history.db")
+    history.add_argument("--out", default=DEFAULT_REPLAY_FILE)
+    history.add_argument("--limit", type=int, default=1000)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run_replay(args)
+    elif args.command == "mock-llm":
+        serve_mock_llm(args)
+    else:
+        export_history(args)
+
+
+if __name__ == "__main__":
+    main()
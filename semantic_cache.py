@@ -0,0 +1,193 @@
+# semantic_cache.py
+# 질문 임베딩 기반 응답 캐시: 거의 같은 질문이면 Gemini 호출 없이 이전 답변을 재사용
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# 디스크 저장은 put마다 파일 전체를 다시 쓰지 않고 백그라운드 스레드가 한 줄씩 덧붙임 (JSONL)
+# 파일 줄 수가 max_size의 이 배수를 넘거나 종료할 때만 현재 내용으로 다시 씀
+COMPACT_FACTOR = 2
+
+
+class SemanticCache:
+    def __init__(self, threshold=0.95, ttl=86400, max_size=256, path=None):
+        self.threshold = threshold  # 코사인 유사도가 이 값 이상이면 같은 질문으로 취급
+        self.ttl = ttl              # 초 단위 유효 기간
+        self.max_size = max_size    # 초과 시 가장 오래 안 쓴 항목부터 삭제 (LRU)
+        self.path = path            # None이면 메모리에만 보관
+        self.entries = OrderedDict()  # key -> {"embedding", "value", "created", "namespace"}
+        self.hits = 0
+        self.misses = 0
+        self._next_key = 0
+        self._lock = threading.Lock()
+        self._lines = 0  # 파일에 쌓인 줄 수
+        self._queue = queue.Queue()  # 저장 스레드에 넘길 작업 ("put", 항목) / ("clear", None) / ("close", None)
+        self._writer = None
+        self._load()
+        if self.path:
+            self._writer = threading.Thread(target=self._writer_loop, name="semantic-cache-writer", daemon=True)
+            self._writer.start()
+            atexit.register(self.close)
+
+    @staticmethod
+    def _normalize(embedding):
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def get(self, embedding, namespace=""):
+        """가장 비슷한 캐시 항목의 값을 반환 (없으면 None). namespace가 같은 항목끼리만 비교"""
+        query = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            # 만료된 항목 정리
+            expired = [k for k, e in self.entries.items() if now - e["created"] > self.ttl]
+            for k in expired:
+                del self.entries[k]
+
+            best_key, best_score = None, -1.0
+            for k, e in self.entries.items():
+                if e["namespace"] != namespace:
+                    continue
+                score = float(np.dot(query, e["embedding"]))
+                if score > best_score:
+                    best_key, best_score = k, score
+
+            if best_key is not None and best_score >= self.threshold:
+                self.entries.move_to_end(best_key)
+                self.hits += 1
+                return self.entries[best_key]["value"]
+            self.misses += 1
+            return None
+
+    def put(self, embedding, value, namespace=""):
+        """메모리에만 바로 반영 (파일 저장은 백그라운드 스레드가 하므로 이벤트 루프에서 불러도 됨)"""
+        entry = {
+            "embedding": self._normalize(embedding),
+            "value": value,
+            "created": time.time(),
+            "namespace": namespace,
+        }
+        with self._lock:
+            self.entries[self._next_key] = entry
+            self._next_key += 1
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        if self._writer is not None:
+            self._queue.put(("put", entry))
+
+    def clear(self):
+        """지식 베이스가 바뀌면 기존 답변은 더 이상 유효하지 않으므로 전부 비움"""
+        with self._lock:
+            self.entries.clear()
+        if self._writer is not None:
+            self._queue.put(("clear", None))
+
+    def flush(self):
+        """대기 중인 저장 작업이 끝날 때까지 기다림"""
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.join()
+
+    def close(self):
+        """남은 항목을 저장하고 파일을 현재 내용으로 정리한 뒤 저장 스레드 종료 (프로세스 종료 시 자동 호출)"""
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(("close", None))
+            self._writer.join(timeout=10)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def _writer_loop(self):
+        while True:
+            ops = [self._queue.get()]
+            # 밀린 작업은 모아서 한 번에 저장
+            while True:
+                try:
+                    ops.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = False
+            try:
+                lines = []
+                for op, entry in ops:
+                    if op == "put":
+                        lines.append(self._dump(entry))
+                    elif op == "clear":
+                        # 비우기 전에 들어온 항목은 더 이상 유효하지 않으므로 쓰지 않음
+                        lines = []
+                        self._rewrite([])
+                    else:
+                        stop = True
+                self._append(lines)
+                if stop or self._lines > COMPACT_FACTOR * self.max_size:
+                    with self._lock:
+                        entries = list(self.entries.values())
+                    self._rewrite(entries)
+            except Exception as e:
+                print(f"캐시 저장 실패: {e}")
+            for _ in ops:
+                self._queue.task_done()
+            if stop:
+                return
+
+    @staticmethod
+    def _dump(entry):
+        return json.dumps({"embedding": entry["embedding"].tolist(), "value": entry["value"],
+                           "created": entry["created"], "namespace": entry["namespace"]},
+                          ensure_ascii=False) + "\n"
+
+    def _append(self, lines):
+        if not lines:
+            return
+        # 여러 워커가 같은 파일에 덧붙이므로 O_APPEND로 한 번에 씀
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, "".join(lines).encode("utf-8"))
+        finally:
+            os.close(fd)
+        self._lines += len(lines)
+
+    def _rewrite(self, entries):
+        # 여러 워커가 같은 파일을 쓰므로 임시 파일은 프로세스별로
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(self._dump(entry) for entry in entries)
+        os.replace(tmp_path, self.path)
+        self._lines = len(entries)
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        now = time.time()
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    self._lines += 1
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        continue  # 쓰다가 끊긴 줄은 건너뜀
+                    if now - item["created"] > self.ttl:
+                        continue
+                    self.entries[self._next_key] = {
+                        "embedding": np.asarray(item["embedding"], dtype=np.float32),
+                        "value": tuple(item["value"]),
+                        "created": item["created"],
+                        "namespace": item.get("namespace", ""),
+                    }
+                    self._next_key += 1
+        except Exception as e:
+            print(f"캐시 로드 실패: {e}")
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
@@ -0,0 +1,103 @@
+# session_store.py
+# 여러 턴 상담용 대화 세션: 오래된 대화는 요약으로 접고, 최근 몇 턴만 원문으로 유지
+# (대화가 길어져도 프롬프트 크기 = 요약 + 최근 턴으로 일정하게 유지)
+# 세션은 프로세스 메모리에 보관되므로 여러 워커로 띄울 때는 session_id 기준 sticky 라우팅 필요
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+
+# 세션 유지 시간(초), 최대 세션 수
+SESSION_TTL = int(os.getenv("SESSION_TTL_SECONDS", "3600"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+# 원문 그대로 넣는 최근 턴 수, 대화 맥락(요약 + 최근 턴)에 쓸 토큰 예산
+SESSION_RECENT_TURNS = int(os.getenv("SESSION_RECENT_TURNS", "3"))
+SESSION_TOKEN_BUDGET = int(os.getenv("SESSION_TOKEN_BUDGET", "1500"))
+# 요약 최대 길이(글자), 한 턴의 질문/답변을 맥락에 넣을 때 최대 길이(글자)
+SESSION_SUMMARY_CHARS = int(os.getenv("SESSION_SUMMARY_CHARS", "800"))
+SESSION_TURN_CHARS = int(os.getenv("SESSION_TURN_CHARS", "1200"))
+
+
+def estimate_tokens(text):
+    """대략적인 토큰 수 (한국어는 글자 2개당 토큰 1개 정도)"""
+    return math.ceil(len(text) / 2)
+
+
+class Session:
+    def __init__(self, session_id):
+        self.id = session_id
+        self.summary = ""       # 요약으로 접은 예전 대화
+        self.turns = []         # 아직 요약하지 않은 대화 [(학생, 상담사), ...]
+        self.retrieval = None   # 마지막 검색 결과 {"embedding", "found_tips", "sources"}
+        self.updated = time.time()
+        self.summarizing = False
+        self.lock = threading.Lock()
+
+    @property
+    def is_new(self):
+        return not self.turns and not self.summary
+
+    def add_turn(self, user_text, answer):
+        with self.lock:
+            self.turns.append((user_text, answer))
+            self.updated = time.time()
+
+    def turns_to_fold(self):
+        """요약으로 접어야 할 오래된 턴 (이미 요약 중이면 빈 목록)"""
+        with self.lock:
+            if self.summarizing or len(self.turns) <= SESSION_RECENT_TURNS:
+                return []
+            self.summarizing = True
+            return self.turns[:-SESSION_RECENT_TURNS]
+
+    def fold(self, summary, folded):
+        """요약 갱신 결과 반영 (요약하는 동안 추가된 턴은 그대로 둠)"""
+        with self.lock:
+            if summary is not None:
+                self.summary = summary[:SESSION_SUMMARY_CHARS]
+                del self.turns[:len(folded)]
+            self.summarizing = False
+
+    def context(self, budget=SESSION_TOKEN_BUDGET):
+        """
+        프롬프트에 넣을 대화 맥락 (요약, 최근 대화 문자열)
+        최근 턴은 최신부터 예산 안에 들어가는 만큼만 (요약이 밀려난 턴을 아직 못 접었어도 예산은 지킴)
+        """
+        with self.lock:
+            summary, turns = self.summary, list(self.turns[-SESSION_RECENT_TURNS:])
+        used = estimate_tokens(summary)
+        recent = []
+        for user_text, answer in reversed(turns):
+            block = f"학생: {user_text[:SESSION_TURN_CHARS]}\n상담사: {answer[:SESSION_TURN_CHARS]}"
+            cost = estimate_tokens(block)
+            if used + cost > budget:
+                break
+            recent.insert(0, block)
+            used += cost
+        return summary, "\n\n".join(recent)
+
+
+class SessionStore:
+    """session_id → Session (오래 안 쓴 세션부터 삭제, SESSION_TTL이 지나면 만료)"""
+
+    def __init__(self, ttl=SESSION_TTL, max_sessions=SESSION_MAX):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        now = time.time()
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None or now - session.updated > self.ttl:
+                session = self.sessions[session_id] = Session(session_id)
+            self.sessions.move_to_end(session_id)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+            return session
+
+    def reset(self, session_id):
+        with self._lock:
+            self.sessions.pop(session_id, None)
@@ -0,0 +1,66 @@
+# text_utils.py
+# 자소서/이력서 텍스트 분할 도구 (파일 파싱 라이브러리 없이 rag_system에서도 쓰기 위해 분리)
+import re
+import math
+
+# 자소서에서 자주 쓰는 섹션 제목 패턴 ([지원동기], 1. 성장과정, ■ 입사 후 포부, # 경력 등)
+SECTION_HEADING = re.compile(
+    r"^\s*(\[[^\]]{1,40}\]|<[^>]{1,40}>|[■□●◆▶#]+\s*\S.{0,40}|\d{1,2}[.)]\s*\S.{0,40}|"
+    r"(지원\s*동기|성장\s*과정|성격의?\s*장단점|입사\s*후\s*포부|직무\s*역량|경력\s*사항|프로젝트|학력|자격증|수상)\s*:?)\s*$"
+)
+
+
+def chunk_resume(text, max_chars=1500):
+    """
+    자소서/이력서를 섹션 단위로 나누기 (검색·프롬프트용)
+    섹션 제목을 기준으로 자르고, 너무 긴 섹션은 문단 경계에서 max_chars 이하로 다시 나눔
+    반환: [{"title": 섹션 제목, "offset": 시작 위치, "text": 내용}, ...]
+    """
+    sections = []
+    title, start, lines = "", 0, []
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        if SECTION_HEADING.match(line) and "".join(lines).strip():
+            sections.append((title, start, "".join(lines)))
+            title, start, lines = line.strip(), offset, [line]
+        else:
+            if not "".join(lines).strip() and SECTION_HEADING.match(line):
+                title = line.strip()
+            lines.append(line)
+        offset += len(line)
+    if "".join(lines).strip():
+        sections.append((title, start, "".join(lines)))
+
+    chunks = []
+    for title, start, body in sections:
+        if len(body) <= max_chars:
+            chunks.append({"title": title, "offset": start, "text": body.strip()})
+            continue
+        # 긴 섹션은 빈 줄(문단) 기준으로 max_chars 안에 들어가게 묶음
+        piece, piece_start, pos = "", start, start
+        for para in re.split(r"(\n\s*\n)", body):
+            if piece and len(piece) + len(para) > max_chars:
+                chunks.append({"title": title, "offset": piece_start, "text": piece.strip()})
+                piece, piece_start = "", pos
+            while len(para) > max_chars:  # 문단 하나가 너무 길면 강제로 자름
+                chunks.append({"title": title, "offset": pos, "text": para[:max_chars].strip()})
+                para, pos = para[max_chars:], pos + max_chars
+                piece_start = pos
+            piece += para
+            pos += len(para)
+        if piece.strip():
+            chunks.append({"title": title, "offset": piece_start, "text": piece.strip()})
+    return [c for c in chunks if c["text"]]
+
+
+def merge_chunks(chunks, max_count):
+    """청크가 max_count개를 넘으면 이웃한 청크끼리 합쳐서 max_count개 이하로 줄임 (순서 유지)"""
+    if len(chunks) <= max_count:
+        return chunks
+    size = math.ceil(len(chunks) / max_count)
+    merged = []
+    for start in range(0, len(chunks), size):
+        group = chunks[start:start + size]
+        merged.append({"title": group[0]["title"], "offset": group[0]["offset"],
+                       "text": "\n\n".join(chunk["text"] for chunk in group)})
+    return merged
@@ -1,44 +1,316 @@
 # user_db.py (새로 만들기)
+import os
+import io
+import csv
+import json
+import time
+import queue
+import atexit
 import sqlite3
-import pandas as pd
+import threading
 from datetime import datetime
+from metrics import stage_timer
 
 DB_NAME = "monitor/user_history.db"
 
+# 쓰기는 백그라운드 스레드가 모아서 한 트랜잭션으로 처리 (요청 경로에서 fsync 제거)
+# USER_DB_ASYNC_WRITES=0 이면 예전처럼 바로 저장
+ASYNC_WRITES = os.getenv("USER_DB_ASYNC_WRITES", "1") == "1"
+WRITE_BATCH_SIZE = int(os.getenv("USER_DB_WRITE_BATCH", "100"))
+WRITE_FLUSH_SECONDS = float(os.getenv("USER_DB_FLUSH_SECONDS", "0.5"))
+
+# history 테이블에 나중에 추가된 컬럼 (예전 DB는 init_user_db에서 ALTER TABLE로 추가)
+EXTRA_COLUMNS = {
+    "latency_ms": "REAL",
+    "mode": "TEXT",
+    "sources": "TEXT",
+    "trace_id": "TEXT",
+}
+
+# 관리자 화면 목록에서 보여줄 미리보기 길이 (전체 자소서를 매번 읽지 않기 위함)
+PREVIEW_CHARS = 120
+
+_fts_enabled = False
+_conn = None
+_conn_pid = None
+_conn_lock = threading.Lock()
+_write_queue = queue.Queue()
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def _get_conn():
+    """프로세스당 하나의 연결 (WAL 모드). fork된 워커는 자기 연결을 새로 엶"""
+    global _conn, _conn_pid
+    if _conn is None or _conn_pid != os.getpid():
+        os.makedirs(os.path.dirname(DB_NAME) or ".", exist_ok=True)
+        _conn = sqlite3.connect(DB_NAME, check_same_thread=False, timeout=10)
+        _conn.execute("PRAGMA journal_mode=WAL")     # 읽기와 쓰기가 서로 막지 않음
+        _conn.execute("PRAGMA synchronous=NORMAL")   # WAL에서는 커밋마다 fsync하지 않아도 안전
+        _conn.execute("PRAGMA busy_timeout=5000")
+        _conn.execute("PRAGMA temp_store=MEMORY")
+        _conn.execute("PRAGMA cache_size=-20000")    # 약 20MB
+        _conn_pid = os.getpid()
+    return _conn
+
+
 def init_user_db():
     """사용자 데이터 저장용 DB 테이블 생성"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    # 자소서 내용(input)과 AI의 조언(output)을 모두 저장
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            user_input TEXT,
-            ai_response TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def save_message(user_input, ai_response):
-    """채팅 내용 저장"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+    with _conn_lock:
+        conn = _get_conn()
+        # 자소서 내용(input)과 AI의 조언(output)을 모두 저장
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT,
+                user_input TEXT,
+                ai_response TEXT
+            )
+        ''')
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(history)")}
+        for column, column_type in EXTRA_COLUMNS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE history ADD COLUMN {column} {column_type}")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history(timestamp)")
+        _init_fts(conn)
+        conn.commit()
+    if ASYNC_WRITES:
+        _start_writer()
+
+
+def _init_fts(conn):
+    """user_input / ai_response 전문 검색용 FTS5 인덱스 (trigram이라 한국어 부분 검색 가능)"""
+    global _fts_enabled
+    try:
+        created = not conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='history_fts'").fetchone()
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+                user_input, ai_response, content='history', content_rowid='id', tokenize='trigram'
+            )
+        ''')
+        # history가 바뀌면 FTS 인덱스도 같이 갱신
+        conn.executescript('''
+            CREATE TRIGGER IF NOT EXISTS history_fts_insert AFTER INSERT ON history BEGIN
+                INSERT INTO history_fts(rowid, user_input, ai_response)
+                VALUES (new.id, new.user_input, new.ai_response);
+            END;
+            CREATE TRIGGER IF NOT EXISTS history_fts_delete AFTER DELETE ON history BEGIN
+                INSERT INTO history_fts(history_fts, rowid, user_input, ai_response)
+                VALUES ('delete', old.id, old.user_input, old.ai_response);
+            END;
+            CREATE TRIGGER IF NOT EXISTS history_fts_update AFTER UPDATE ON history BEGIN
+                INSERT INTO history_fts(history_fts, rowid, user_input, ai_response)
+                VALUES ('delete', old.id, old.user_input, old.ai_response);
+                INSERT INTO history_fts(rowid, user_input, ai_response)
+                VALUES (new.id, new.user_input, new.ai_response);
+            END;
+        ''')
+        if created:
+            # 기존 기록 색인
+            conn.execute("INSERT INTO history_fts(history_fts) VALUES ('rebuild')")
+        _fts_enabled = True
+    except sqlite3.OperationalError as e:
+        # FTS5(trigram)를 지원하지 않는 SQLite면 LIKE 검색으로 대체
+        print(f"전문 검색 인덱스 생성 실패, LIKE 검색 사용: {e}")
+        _fts_enabled = False
+
+
+def _write_rows(rows):
+    with stage_timer("db_write"), _conn_lock:
+        conn = _get_conn()
+        with conn:  # 한 번의 트랜잭션으로 커밋
+            conn.executemany('''
+                INSERT INTO history (timestamp, user_input, ai_response, latency_ms, mode, sources, trace_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+
+
+def _writer_loop():
+    while True:
+        row = _write_queue.get()
+        if row is None:
+            _write_queue.task_done()
+            return
+        rows = [row]
+        stop = False
+        # 첫 행부터 최대 WRITE_FLUSH_SECONDS 동안 들어온 것들을 모아서 한 번에 저장
+        # (계속 들어와도 이 시간이 지나면 저장하므로, 비정상 종료 시 잃는 기록은 이 시간만큼)
+        deadline = time.monotonic() + WRITE_FLUSH_SECONDS
+        try:
+            while len(rows) < WRITE_BATCH_SIZE:
+                row = _write_queue.get(timeout=max(0, deadline - time.monotonic()))
+                if row is None:
+                    stop = True
+                    break
+                rows.append(row)
+        except queue.Empty:
+            pass
+        try:
+            _write_rows(rows)
+        except Exception as e:
+            print(f"기록 저장 실패 ({len(rows)}건): {e}")
+        for _ in range(len(rows) + stop):
+            _write_queue.task_done()
+        if stop:
+            return
+
+
+def _start_writer():
+    global _writer, _writer_pid
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive() or _writer_pid != os.getpid():
+            _writer = threading.Thread(target=_writer_loop, name="user-db-writer", daemon=True)
+            _writer.start()
+            _writer_pid = os.getpid()
+
+
+def flush():
+    """대기 중인 기록을 모두 저장할 때까지 기다림"""
+    if _writer is not None and _writer.is_alive():
+        _write_queue.join()
+
+
+def shutdown():
+    """남은 기록을 저장하고 백그라운드 저장 스레드 종료 (프로세스 종료 시 자동 호출)"""
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        _write_queue.put(None)
+        _writer.join(timeout=10)
+    _writer = None
+
+
+atexit.register(shutdown)
+
+
+def save_message(user_input, ai_response, latency_ms=None, mode=None, sources=None, trace_id=None):
+    """채팅 내용 저장 (응답 시간, 처리 방식, 참고한 출처 등 메타 정보 포함)"""
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    cursor.execute('''
-        INSERT INTO history (timestamp, user_input, ai_response) 
-        VALUES (?, ?, ?)
-    ''', (now, user_input, ai_response))
-    
-    conn.commit()
-    conn.close()
+    row = (now, user_input, ai_response, latency_ms, mode,
+           json.dumps(sources, ensure_ascii=False) if sources is not None else None, trace_id)
+    # 기록 저장은 부가 기능이므로 실패해도 예외를 올리지 않음 (이미 만든 답변이 500이 되지 않게)
+    if ASYNC_WRITES:
+        # init_user_db 전(lifespan 없이 앱을 띄운 경우 등)에도 요청 경로에서 직접 쓰지 않도록 저장 스레드를 띄움
+        _start_writer()
+        _write_queue.put(row)
+        return
+    try:
+        _write_rows([row])
+    except Exception as e:
+        print(f"기록 저장 실패: {e}")
+
 
 def get_all_history():
     """저장된 모든 데이터 가져오기 (관리자용)"""
-    conn = sqlite3.connect(DB_NAME)
-    # pandas를 이용해 보기 좋은 표 형태로 가져옴
-    df = pd.read_sql_query("SELECT * FROM history ORDER BY id DESC", conn)
-    conn.close()
-    return df
\ No newline at end of file
+    import pandas as pd  # API 서버에서는 쓰지 않으므로 필요할 때만 import
+    flush()
+    with _conn_lock:
+        # pandas를 이용해 보기 좋은 표 형태로 가져옴
+        df = pd.read_sql_query("SELECT * FROM history ORDER BY id DESC", _get_conn())
+    return df
+
+
+def _history_filters(start_date=None, end_date=None, search=None):
+    """날짜(YYYY-MM-DD, 끝 날짜 포함)와 검색어 조건 → (WHERE 절 목록, 파라미터)"""
+    clauses, params = [], []
+    if start_date:
+        clauses.append("h.timestamp >= ?")
+        params.append(str(start_date))
+    if end_date:
+        clauses.append("h.timestamp < date(?, '+1 day')")
+        params.append(str(end_date))
+    if search:
+        if _fts_enabled and len(search) >= 3:
+            # trigram은 3글자 이상부터 색인됨
+            clauses.append("h.id IN (SELECT rowid FROM history_fts WHERE history_fts MATCH ?)")
+            params.append('"' + search.replace('"', '""') + '"')
+        else:
+            clauses.append("(h.user_input LIKE ? OR h.ai_response LIKE ?)")
+            params += [f"%{search}%", f"%{search}%"]
+    return clauses, params
+
+
+def query_history(limit=50, before_id=None, start_date=None, end_date=None, search=None,
+                  preview_chars=PREVIEW_CHARS):
+    """
+    관리자용 기록 조회 (최신순, keyset 페이지네이션)
+    before_id: 이전 페이지의 next_before_id (없으면 첫 페이지)
+    반환: (행 목록, 다음 페이지용 before_id 또는 None)
+    """
+    flush()
+    clauses, params = _history_filters(start_date, end_date, search)
+    if before_id is not None:
+        clauses.append("h.id < ?")
+        params.append(before_id)
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    sql = f'''
+        SELECT h.id, h.timestamp, substr(h.user_input, 1, ?) AS user_input,
+               substr(h.ai_response, 1, ?) AS ai_response,
+               length(h.ai_response) AS response_length, h.latency_ms, h.mode, h.sources
+        FROM history h {where}
+        ORDER BY h.id DESC LIMIT ?
+    '''
+    with _conn_lock:
+        cursor = _get_conn().execute(sql, [preview_chars, preview_chars] + params + [limit + 1])
+        columns = [col[0] for col in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    next_before_id = rows[limit - 1]["id"] if len(rows) > limit else None
+    return rows[:limit], next_before_id
+
+
+def get_history_entry(entry_id):
+    """기록 한 건 전체 내용"""
+    flush()
+    with _conn_lock:
+        cursor = _get_conn().execute("SELECT * FROM history WHERE id = ?", (entry_id,))
+        row = cursor.fetchone()
+        return dict(zip([col[0] for col in cursor.description], row)) if row else None
+
+
+def history_stats(start_date=None, end_date=None):
+    """일별 요청 수 / 평균 답변 길이 / 평균 응답 시간 (SQL에서 집계)"""
+    flush()
+    clauses, params = _history_filters(start_date, end_date)
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    with _conn_lock:
+        cursor = _get_conn().execute(f'''
+            SELECT substr(h.timestamp, 1, 10) AS day, COUNT(*) AS requests,
+                   AVG(length(h.ai_response)) AS avg_response_length, AVG(h.latency_ms) AS avg_latency_ms
+            FROM history h {where}
+            GROUP BY day ORDER BY day
+        ''', params)
+        columns = [col[0] for col in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def iter_history_csv(start_date=None, end_date=None, search=None, chunk_rows=500):
+    """조건에 맞는 기록을 CSV 문자열 조각으로 하나씩 내보냄 (전체를 메모리에 올리지 않음)"""
+    flush()
+    clauses, params = _history_filters(start_date, end_date, search)
+    base_where = " AND ".join(clauses)
+    columns = ["id", "timestamp", "user_input", "ai_response", "latency_ms", "mode", "sources", "trace_id"]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    last_id = None
+    while True:
+        # 청크마다 keyset으로 이어서 읽으므로 잠금을 오래 잡지 않음
+        where = [base_where] if base_where else []
+        chunk_params = list(params)
+        if last_id is not None:
+            where.append("h.id < ?")
+            chunk_params.append(last_id)
+        sql = (f"SELECT {', '.join('h.' + c for c in columns)} FROM history h "
+               f"{'WHERE ' + ' AND '.join(where) if where else ''} ORDER BY h.id DESC LIMIT ?")
+        with _conn_lock:
+            rows = _get_conn().execute(sql, chunk_params + [chunk_rows]).fetchall()
+        if not rows:
+            break
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        last_id = rows[-1][0]
+    if buffer.getvalue():
+        yield buffer.getvalue()
\ No newline at end of file